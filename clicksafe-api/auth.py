@@ -2,11 +2,13 @@
 Authentication utilities for JWT tokens, password hashing, etc.
 """
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from typing import Dict, Optional, Tuple, Union
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+import hashlib
 import secrets
 import string
+import time
 
 # JWT Configuration
 SECRET_KEY = "your-secret-key-change-this-in-production"  # Change this in production!
@@ -14,6 +16,11 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
+# Verified token payloads are reused for this long (never past the token's exp)
+TOKEN_CACHE_TTL_SECONDS = 30
+TOKEN_CACHE_MAX_SIZE = 10000
+_verified_tokens: Dict[bytes, Tuple[float, dict]] = {}
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -53,6 +60,24 @@ def verify_token(token: str) -> Optional[dict]:
     except JWTError:
         return None
 
+def verify_token_cached(token: str) -> Optional[dict]:
+    """verify_token, reusing payloads verified in the last TOKEN_CACHE_TTL_SECONDS
+    
+    Only valid tokens are cached; callers must not mutate the returned payload.
+    """
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    now = time.time()
+    cached = _verified_tokens.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    
+    payload = verify_token(token)
+    if payload is not None:
+        if len(_verified_tokens) >= TOKEN_CACHE_MAX_SIZE:
+            del _verified_tokens[next(iter(_verified_tokens))]
+        _verified_tokens[key] = (min(now + TOKEN_CACHE_TTL_SECONDS, payload.get("exp", now)), payload)
+    return payload
+
 def generate_reset_token() -> str:
     """Generate a secure random token for password reset"""
     alphabet = string.ascii_letters + string.digits
@@ -2,10 +2,11 @@
 Authentication routes and dependencies
 """
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Union
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import and_
 
 from database import get_db
@@ -17,7 +18,7 @@ from schemas import (
 )
 from auth import (
     verify_password, get_password_hash, create_access_token,
-    create_refresh_token, verify_token, generate_reset_token
+    create_refresh_token, verify_token, verify_token_cached, generate_reset_token
 )
 
 # Create router
@@ -33,7 +34,7 @@ async def get_current_user(
 ) -> User:
     """Get current authenticated user"""
     token = credentials.credentials
-    payload = verify_token(token)
+    payload = verify_token_cached(token)
     
     if payload is None or payload.get("type") != "access":
         raise HTTPException(
@@ -83,9 +84,14 @@ async def log_user_activity(
     description: str = None,
     details: dict = None,
     request: Request = None,
-    db: Session = None
+    db: Union[Session, AsyncSession] = None,
+    flush_only: bool = False
 ):
-    """Log user activity"""
+    """Log user activity
+    
+    With flush_only the row joins the caller's transaction and is committed
+    together with it, instead of paying for a separate commit.
+    """
     if db is None:
         return
     
@@ -99,7 +105,12 @@ async def log_user_activity(
     )
     
     db.add(activity)
-    db.commit()
+    if isinstance(db, AsyncSession):
+        await (db.flush() if flush_only else db.commit())
+    elif flush_only:
+        db.flush()
+    else:
+        db.commit()
 
 @auth_router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register_user(
@@ -0,0 +1,21 @@
+"""
+Micro-batching helper shared by the background queue workers
+"""
+import asyncio
+from typing import Any, List
+
+async def collect_batch(queue: asyncio.Queue, max_batch_size: int, max_latency: float) -> List[Any]:
+    """Wait for one item, then collect more until the batch is full or max_latency seconds pass"""
+    loop = asyncio.get_running_loop()
+    batch = [await queue.get()]
+    
+    deadline = loop.time() + max_latency
+    while len(batch) < max_batch_size:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+    return batch
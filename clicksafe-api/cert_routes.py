@@ -2,11 +2,13 @@
 CERT Reporting API Routes
 Handles submission of phishing reports to Sri Lanka CERT
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
-from pydantic import BaseModel, EmailStr, validator
+from pydantic import BaseModel, EmailStr, ConfigDict, model_validator
 from typing import Optional
 import logging
+import zlib
 from datetime import datetime
 
 from database import get_db
@@ -19,7 +21,10 @@ production_cert_service = ProductionCERTService()
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter(prefix="/api/cert", tags=["CERT Reporting"])
+# security_analysis keys the CERT report actually uses; everything else is dropped
+CERT_ANALYSIS_KEYS = ('message_content',)
+
+router = APIRouter(prefix="/api/cert", tags=["CERT Reporting"], default_response_class=ORJSONResponse)
 
 class CERTReportRequest(BaseModel):
     """Request model for CERT phishing reports"""
@@ -33,17 +38,18 @@ class CERTReportRequest(BaseModel):
     security_analysis: dict
     comments: Optional[str] = ""
     
-    @validator('risk_score')
-    def validate_risk_score(cls, v):
-        if not 0 <= v <= 100:
-            raise ValueError('Risk score must be between 0 and 100')
-        return v
+    model_config = ConfigDict(strict=True)
     
-    @validator('confidence')
-    def validate_confidence(cls, v):
-        if not 0 <= v <= 1:
+    @model_validator(mode='after')
+    def validate_report(self):
+        if not 0 <= self.risk_score <= 100:
+            raise ValueError('Risk score must be between 0 and 100')
+        if not 0 <= self.confidence <= 1:
             raise ValueError('Confidence must be between 0 and 1')
-        return v
+        # Accept medium risk (50+) and above
+        if self.risk_score < 50:
+            raise ValueError('CERT reports are only accepted for medium-risk threats and above (score >= 50%)')
+        return self
 
 class CERTReportResponse(BaseModel):
     """Response model for CERT report submission"""
@@ -55,6 +61,7 @@ class CERTReportResponse(BaseModel):
 @router.post("/report", response_model=CERTReportResponse)
 async def submit_cert_report(
     report: CERTReportRequest,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -63,63 +70,57 @@ async def submit_cert_report(
     
     This endpoint accepts medium-risk and above phishing detections and automatically
     sends detailed reports to the Sri Lanka National Centre for Cyber Security.
+    The email is delivered in the background after the response is returned.
     
     Requirements:
     - User must be authenticated
-    - Risk score must be >= 50% (medium risk and above)
+    - Risk score must be >= 50% (medium risk and above, enforced by CERTReportRequest)
     - Valid URL and security analysis data required
     """
     
     try:
-        # Validate risk threshold - accept medium, high, and critical risk reports
-        if report.risk_score < 50:  # Accept medium risk (50+) and above
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="CERT reports are only accepted for medium-risk threats and above (score >= 50%)"
-            )
+        now = datetime.now()
+        
+        security_analysis = {
+            key: report.security_analysis[key]
+            for key in CERT_ANALYSIS_KEYS if key in report.security_analysis
+        }
         
         # Prepare report data
         report_data = {
             'url': report.url,
-            'content': report.content or report.security_analysis.get('message_content', ''),  # Get content from either field
+            'content': report.content or security_analysis.get('message_content', ''),  # Get content from either field
             'risk_score': report.risk_score,
             'risk_level': report.risk_level,
             'classification': report.classification,
             'confidence': report.confidence,
             'reasoning': report.reasoning,
-            'security_analysis': report.security_analysis,
+            'security_analysis': security_analysis,
             'comments': report.comments,
             'user_email': current_user.email,
             'submitted_by': current_user.full_name or current_user.username,
-            'submission_time': datetime.now()
+            'submission_time': now
         }
         
         # Log the report attempt
         logger.info(f"CERT report submission attempt by {current_user.email} for URL: {report.url}")
         
-        # Send email to CERT using production service
-        email_sent = await production_cert_service.send_cert_report(report_data)
-        
-        if not email_sent:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to send report to CERT. Please try again later."
-            )
+        # Generate report ID for tracking (crc32 is stable across processes, unlike hash())
+        report_id = f"CS-{now.strftime('%Y%m%d')}-{zlib.crc32(report.url.encode()) % 10000:04d}"
         
-        # Generate report ID for tracking
-        report_id = f"CS-{datetime.now().strftime('%Y%m%d')}-{abs(hash(report.url)) % 10000:04d}"
+        # Send email to CERT using production service, off the request path
+        background_tasks.add_task(production_cert_service.send_cert_report, report_data)
         
-        # Log successful submission
-        logger.info(f"CERT report {report_id} successfully submitted for URL: {report.url}")
+        logger.info(f"CERT report {report_id} queued for URL: {report.url}")
         
         # TODO: Store report in database for tracking
         # This could be implemented later for report history and analytics
         
         return CERTReportResponse(
             success=True,
-            message="Report successfully submitted to Sri Lanka CERT. You will receive a confirmation email shortly.",
+            message="Report queued for submission to Sri Lanka CERT. You will receive a confirmation email shortly.",
             report_id=report_id,
-            submitted_at=datetime.now()
+            submitted_at=now
         )
         
     except HTTPException:
@@ -3,16 +3,22 @@ Create a placeholder ML model for QR URL Safety Analysis
 This creates a basic model structure that can be replaced with your trained model
 """
 import pickle
+import joblib
 import numpy as np
+from scipy.sparse import hstack, csr_matrix
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.preprocessing import LabelEncoder
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 import pandas as pd
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+# Single alternation scanned once per URL, case-insensitively (no per-URL lowercasing)
+SUSPICIOUS_KEYWORDS_RE = re.compile(r'secure|update|verify|urgent', re.IGNORECASE)
+
 def create_placeholder_model():
     """Create a placeholder model for QR URL safety analysis"""
     
@@ -50,31 +56,30 @@ def create_placeholder_model():
             max_features=1000,
             ngram_range=(1, 2),
             lowercase=True,
-            stop_words='english'
+            stop_words='english',
+            dtype=np.float32  # Trees split on float32 anyway; avoids a float64 copy
         )
         
         # Transform URLs to feature vectors
         X_text = vectorizer.fit_transform(sample_urls)
         
-        # Create additional numerical features
-        numerical_features = []
-        for url in sample_urls:
-            features = [
-                len(url),  # URL length
-                len(url.split('.')),  # Domain parts
-                len(url.split('/')),  # Path parts
-                url.count('-'),  # Hyphen count
-                int('http://' in url),  # Non-HTTPS
-                int(any(word in url.lower() for word in ['secure', 'update', 'verify', 'urgent'])),  # Suspicious keywords
-                url.count('?'),  # Query parameters
-                int(any(c.isdigit() for c in (url.split('/')[2] if len(url.split('/')) > 2 else ''))),  # Domain has numbers
-                len([c for c in url if not c.isalnum() and c not in '.-_~:/?#[]@!$&\'()*+,;='])  # Special chars
-            ]
-            numerical_features.append(features)
+        # Create additional numerical features (one vectorized pass per feature)
+        urls = pd.Series(sample_urls)
+        hosts = urls.str.split('/').str[2].fillna('')
+        numerical_features = pd.DataFrame({
+            'url_length': urls.str.len(),
+            'domain_parts': urls.str.count(r'\.') + 1,
+            'path_parts': urls.str.count('/') + 1,
+            'hyphen_count': urls.str.count('-'),
+            'non_https': urls.str.contains('http://', regex=False).astype(int),
+            'suspicious_keywords': urls.str.contains(SUSPICIOUS_KEYWORDS_RE).astype(int),
+            'query_params': urls.str.count(r'\?'),
+            'domain_has_numbers': hosts.str.contains(r'\d', regex=True).astype(int),
+            'special_char_count': urls.str.count(r"[^\w.\-~:/?#\[\]@!$&'()*+,;=]")
+        }).to_numpy(dtype=np.float32)
         
-        # Combine text and numerical features
-        X_numerical = np.array(numerical_features)
-        X_combined = np.hstack([X_text.toarray(), X_numerical])
+        # Combine text and numerical features (kept sparse, no dense TF-IDF copy)
+        X_combined = hstack([X_text, csr_matrix(numerical_features)]).tocsr()
         
         # Create label encoder
         label_encoder = LabelEncoder()
@@ -118,8 +123,8 @@ def create_placeholder_model():
         # Create the model file
         model_path = 'H:/App-Project - 2 - Copy/clicksafe-api/qr_url_safety_model.pkl'
         
-        with open(model_path, 'wb') as f:
-            pickle.dump(model_data, f)
+        # Stored uncompressed so loading the package skips decompression
+        joblib.dump(model_data, model_path, protocol=pickle.HIGHEST_PROTOCOL)
         
         print(f"✅ Placeholder model saved to: {model_path}")
         print("📝 Replace this with your actual trained model for production use")
@@ -1,13 +1,18 @@
 """
 Dashboard and scan history routes
 """
+import logging
+import re
 from typing import List, Optional
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, func, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import desc, func, and_, or_, select, case
 
-from database import get_db
+from database import get_db, get_async_db
 from models import User, UserScan, UserActivity, RecentScam
 from schemas import (
     ScanCreate, ScanResponse, ScanFilter, UserStats, DashboardData,
@@ -15,42 +20,62 @@ from schemas import (
 )
 from auth_routes import get_current_user, log_user_activity
 from auth import anonymize_content
+from simple_detector import simple_predict
+
+logger = logging.getLogger(__name__)
 
 # Create routers
-dashboard_router = APIRouter(prefix="/dashboard", tags=["Dashboard"])
-scans_router = APIRouter(prefix="/scans", tags=["Scans"])
+dashboard_router = APIRouter(prefix="/dashboard", tags=["Dashboard"], default_response_class=ORJSONResponse)
+scans_router = APIRouter(prefix="/scans", tags=["Scans"], default_response_class=ORJSONResponse)
+
+# Only the columns ScanResponse serializes; list endpoints never load
+# original_content, ip_address or user_agent
+SCAN_RESPONSE_COLUMNS = tuple(getattr(UserScan, name) for name in ScanResponse.model_fields)
+
+def scan_rows_to_responses(rows) -> List[ScanResponse]:
+    """Wrap narrow UserScan rows in ScanResponse without re-validating DB values"""
+    return [ScanResponse.model_construct(**row._mapping) for row in rows]
+
+async def get_classification_counts(db: AsyncSession, *conditions) -> dict:
+    """Count scans per classification in a single SELECT COUNT statement"""
+    result = await db.execute(
+        select(
+            func.count(UserScan.id),
+            func.count(case((UserScan.classification == 'safe', 1))),
+            func.count(case((UserScan.classification == 'suspicious', 1))),
+            func.count(case((UserScan.classification == 'dangerous', 1)))
+        ).where(*conditions)
+    )
+    total, safe, suspicious, dangerous = result.one()
+    
+    return {
+        "total_scans": total,
+        "safe_scans": safe,
+        "suspicious_scans": suspicious,
+        "dangerous_scans": dangerous
+    }
 
 @dashboard_router.get("/", response_model=DashboardData)
 async def get_dashboard_data(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get user dashboard data"""
     
     # Get user scan statistics
-    total_scans = db.query(UserScan).filter(UserScan.user_id == current_user.id).count()
-    
-    safe_scans = db.query(UserScan).filter(
-        and_(UserScan.user_id == current_user.id, UserScan.classification == 'safe')
-    ).count()
-    
-    suspicious_scans = db.query(UserScan).filter(
-        and_(UserScan.user_id == current_user.id, UserScan.classification == 'suspicious')
-    ).count()
-    
-    dangerous_scans = db.query(UserScan).filter(
-        and_(UserScan.user_id == current_user.id, UserScan.classification == 'dangerous')
-    ).count()
+    scan_counts = await get_classification_counts(db, UserScan.user_id == current_user.id)
     
     # Get recent scans (last 10)
-    recent_scans = db.query(UserScan).filter(
-        UserScan.user_id == current_user.id
-    ).order_by(desc(UserScan.created_at)).limit(10).all()
+    recent_scans = scan_rows_to_responses((await db.execute(
+        select(*SCAN_RESPONSE_COLUMNS).where(UserScan.user_id == current_user.id)
+        .order_by(desc(UserScan.created_at)).limit(10)
+    )).all())
     
     # Get recent activities (last 10)
-    recent_activities = db.query(UserActivity).filter(
-        UserActivity.user_id == current_user.id
-    ).order_by(desc(UserActivity.created_at)).limit(10).all()
+    recent_activities = (await db.scalars(
+        select(UserActivity).where(UserActivity.user_id == current_user.id)
+        .order_by(desc(UserActivity.created_at)).limit(10)
+    )).all()
     
     # Convert activities to dict format
     activities_data = []
@@ -64,10 +89,7 @@ async def get_dashboard_data(
         })
     
     user_stats = UserStats(
-        total_scans=total_scans,
-        safe_scans=safe_scans,
-        suspicious_scans=suspicious_scans,
-        dangerous_scans=dangerous_scans,
+        **scan_counts,
         recent_scans=recent_scans
     )
     
@@ -82,16 +104,13 @@ async def create_scan(
     scan_data: ScanCreate,
     request: Request,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new scan record and analyze content"""
     
     try:
-        # Use simple detector directly
-        from simple_detector import simple_predict
-        
-        # Analyze the content
-        analysis_result = simple_predict(scan_data.content)
+        # Analyze the content in a worker thread so the event loop stays free
+        analysis_result = await run_in_threadpool(simple_predict, scan_data.content)
         
         # Create scan record
         new_scan = UserScan(
@@ -109,10 +128,9 @@ async def create_scan(
         )
         
         db.add(new_scan)
-        db.commit()
-        db.refresh(new_scan)
+        await db.flush()  # Assigns new_scan.id for the activity log below
         
-        # Log scan activity
+        # Log scan activity in the same transaction as the scan
         await log_user_activity(
             user_id=current_user.id,
             activity_type="scan",
@@ -124,9 +142,13 @@ async def create_scan(
                 "risk_score": analysis_result.get('risk_score')
             },
             request=request,
-            db=db
+            db=db,
+            flush_only=True
         )
         
+        await db.commit()
+        await db.refresh(new_scan)
+        
         # If it's a high-risk scam, add to recent scams feed
         if (analysis_result.get('classification') == 'dangerous' or 
             analysis_result.get('risk_score', 0) > 0.7):
@@ -142,40 +164,50 @@ async def create_scan(
 
 @scans_router.get("/", response_model=List[ScanResponse])
 async def get_user_scans(
+    response: Response,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     scan_type: Optional[str] = Query(None),
     classification: Optional[str] = Query(None),
     language: Optional[str] = Query(None),
     date_from: Optional[datetime] = Query(None),
     date_to: Optional[datetime] = Query(None),
     limit: int = Query(50, ge=1, le=200),
-    offset: int = Query(0, ge=0)
+    before_id: Optional[int] = Query(None, ge=1)
 ):
-    """Get user's scan history with filters"""
+    """Get user's scan history with filters (keyset paginated via before_id)"""
     
-    query = db.query(UserScan).filter(UserScan.user_id == current_user.id)
+    query = select(*SCAN_RESPONSE_COLUMNS).where(UserScan.user_id == current_user.id)
     
     # Apply filters
     if scan_type:
-        query = query.filter(UserScan.scan_type == scan_type)
+        query = query.where(UserScan.scan_type == scan_type)
     
     if classification:
-        query = query.filter(UserScan.classification == classification)
+        query = query.where(UserScan.classification == classification)
     
     if language:
-        query = query.filter(UserScan.language == language)
+        query = query.where(UserScan.language == language)
     
     if date_from:
-        query = query.filter(UserScan.created_at >= date_from)
+        query = query.where(UserScan.created_at >= date_from)
     
     if date_to:
         # Add one day to include the entire end date
         date_to_end = date_to + timedelta(days=1)
-        query = query.filter(UserScan.created_at < date_to_end)
+        query = query.where(UserScan.created_at < date_to_end)
+    
+    # Keyset pagination: continue below the last id of the previous page
+    if before_id:
+        query = query.where(UserScan.id < before_id)
+    
+    # Order by most recent (ids grow with created_at) and apply pagination
+    scans = scan_rows_to_responses(
+        (await db.execute(query.order_by(desc(UserScan.id)).limit(limit))).all()
+    )
     
-    # Order by most recent and apply pagination
-    scans = query.order_by(desc(UserScan.created_at)).offset(offset).limit(limit).all()
+    if scans:
+        response.headers["X-Next-Before-Id"] = str(scans[-1].id)
     
     return scans
 
@@ -219,24 +251,26 @@ async def delete_scan(
         )
     
     db.delete(scan)
-    db.commit()
     
-    # Log deletion activity
+    # Log deletion activity, committed together with the delete
     await log_user_activity(
         user_id=current_user.id,
         activity_type="scan_deletion",
         description=f"Deleted {scan.scan_type} scan",
         details={"deleted_scan_id": scan_id},
         request=request,
-        db=db
+        db=db,
+        flush_only=True
     )
     
+    db.commit()
+    
     return {"message": "Scan deleted successfully"}
 
 @scans_router.get("/stats/summary")
 async def get_scan_stats(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     days: int = Query(30, ge=1, le=365)
 ):
     """Get scan statistics for the user"""
@@ -245,48 +279,39 @@ async def get_scan_stats(
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
     
-    # Get scans within date range
-    scans_query = db.query(UserScan).filter(
-        and_(
-            UserScan.user_id == current_user.id,
-            UserScan.created_at >= start_date,
-            UserScan.created_at <= end_date
-        )
-    )
-    
     # Count by classification
-    stats = {
-        "total_scans": scans_query.count(),
-        "safe_scans": scans_query.filter(UserScan.classification == 'safe').count(),
-        "suspicious_scans": scans_query.filter(UserScan.classification == 'suspicious').count(),
-        "dangerous_scans": scans_query.filter(UserScan.classification == 'dangerous').count()
-    }
+    stats = await get_classification_counts(
+        db,
+        UserScan.user_id == current_user.id,
+        UserScan.created_at >= start_date,
+        UserScan.created_at <= end_date
+    )
     
     # Count by scan type
-    scan_types = db.query(
-        UserScan.scan_type,
-        func.count(UserScan.id).label('count')
-    ).filter(
-        and_(
+    scan_types = (await db.execute(
+        select(
+            UserScan.scan_type,
+            func.count(UserScan.id).label('count')
+        ).where(
             UserScan.user_id == current_user.id,
             UserScan.created_at >= start_date,
             UserScan.created_at <= end_date
-        )
-    ).group_by(UserScan.scan_type).all()
+        ).group_by(UserScan.scan_type)
+    )).all()
     
     stats["scan_types"] = {scan_type: count for scan_type, count in scan_types}
     
     # Count by language
-    languages = db.query(
-        UserScan.language,
-        func.count(UserScan.id).label('count')
-    ).filter(
-        and_(
+    languages = (await db.execute(
+        select(
+            UserScan.language,
+            func.count(UserScan.id).label('count')
+        ).where(
             UserScan.user_id == current_user.id,
             UserScan.created_at >= start_date,
             UserScan.created_at <= end_date
-        )
-    ).group_by(UserScan.language).all()
+        ).group_by(UserScan.language)
+    )).all()
     
     stats["languages"] = {language: count for language, count in languages}
     
@@ -310,17 +335,41 @@ async def get_recent_scams(
     
     return recent_scams
 
+def sorted_unique_terms(terms: list) -> list:
+    """Return terms as a sorted, de-duplicated list (the stored RecentScam invariant)"""
+    if all(a < b for a, b in zip(terms, terms[1:])):
+        return list(terms)
+    return sorted(set(terms))
+
+def merge_sorted_terms(left: list, right: list) -> list:
+    """Merge two sorted, de-duplicated term lists in O(a+b) without hashing"""
+    merged = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if left[i] < right[j]:
+            merged.append(left[i])
+            i += 1
+        elif right[j] < left[i]:
+            merged.append(right[j])
+            j += 1
+        else:
+            merged.append(left[i])
+            i += 1
+            j += 1
+    merged.extend(left[i:])
+    merged.extend(right[j:])
+    return merged
+
 # Helper function to add high-risk scams to public feed
-async def add_to_recent_scams(scan: UserScan, db: Session):
+async def add_to_recent_scams(scan: UserScan, db: AsyncSession):
     """Add high-risk scan to recent scams feed with anonymization"""
     
     try:
-        # Anonymize the content
-        anonymized = anonymize_content(scan.content)
+        # Anonymize the content (regex heavy, keep it off the event loop)
+        anonymized = await run_in_threadpool(anonymize_content, scan.content)
         
         # Normalize content for better duplicate detection
         def normalize_content(content):
-            import re
             # Remove extra whitespace, normalize line breaks, convert to lowercase
             normalized = re.sub(r'\s+', ' ', content.lower().strip())
             # Remove common variations in punctuation
@@ -330,9 +379,9 @@ async def add_to_recent_scams(scan: UserScan, db: Session):
         normalized_content = normalize_content(anonymized)
         
         # Check if similar scam already exists with fuzzy matching
-        existing_scams = db.query(RecentScam).filter(
-            RecentScam.original_language == scan.language
-        ).all()
+        existing_scams = (await db.scalars(
+            select(RecentScam).where(RecentScam.original_language == scan.language)
+        )).all()
         
         existing_scam = None
         for scam in existing_scams:
@@ -354,11 +403,12 @@ async def add_to_recent_scams(scan: UserScan, db: Session):
             severity_order = {'safe': 0, 'suspicious': 1, 'dangerous': 2, 'high': 3, 'critical': 4}
             if severity_order.get(scan.classification, 0) > severity_order.get(existing_scam.classification, 0):
                 existing_scam.classification = scan.classification
-            # Merge suspicious terms
+            # Merge suspicious terms (both sides kept sorted-unique)
             if scan.suspicious_terms:
-                existing_terms = set(existing_scam.suspicious_terms or [])
-                new_terms = set(scan.suspicious_terms)
-                existing_scam.suspicious_terms = list(existing_terms.union(new_terms))
+                existing_scam.suspicious_terms = merge_sorted_terms(
+                    sorted_unique_terms(existing_scam.suspicious_terms or []),
+                    sorted_unique_terms(scan.suspicious_terms)
+                )
         else:
             # Create new recent scam entry
             recent_scam = RecentScam(
@@ -366,14 +416,14 @@ async def add_to_recent_scams(scan: UserScan, db: Session):
                 original_language=scan.language,
                 risk_score=scan.risk_score,
                 classification=scan.classification,
-                suspicious_terms=scan.suspicious_terms,
+                suspicious_terms=sorted_unique_terms(scan.suspicious_terms or []),
                 scan_count=1
             )
             db.add(recent_scam)
         
-        db.commit()
+        await db.commit()
         
     except Exception as e:
         # Don't fail the main scan if this fails
-        print(f"Failed to add to recent scams: {e}")
-        db.rollback()
\ No newline at end of file
+        logger.warning("Failed to add to recent scams: %s", e)
+        await db.rollback()
\ No newline at end of file
@@ -6,16 +6,39 @@ import sqlalchemy
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 # Database URL - using SQLite for simplicity, can be changed to PostgreSQL/MySQL
 DATABASE_URL = "sqlite:///./clicksafe.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./clicksafe.db"
 
-# Create database engine
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Create database engine (compiled statements are cached across requests)
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=10,
+    max_overflow=20,
+    query_cache_size=1200
+)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine/sessions for handlers that must not block the event loop.
+# Connections are pooled for the life of the app and disposed on shutdown
+# (aiosqlite defaults to NullPool, which takes no pool sizing).
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=10,
+    max_overflow=20,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    query_cache_size=1200
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
 # Create Base class
 Base = declarative_base()
 
@@ -30,6 +53,14 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Dependency to get async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def create_tables():
-    """Create all tables"""
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    """Create all tables, plus any indexes added since an existing table was created"""
+    Base.metadata.create_all(bind=engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
\ No newline at end of file
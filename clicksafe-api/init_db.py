@@ -43,6 +43,9 @@ def create_admin_user():
     finally:
         db.close()
 
+# Set by launchers that ran init_database() before starting uvicorn workers
+DB_INITIALIZED_ENV = "CLICKSAFE_DB_INITIALIZED"
+
 def init_database():
     """Initialize database with tables and admin user"""
     print("🔧 Initializing database...")
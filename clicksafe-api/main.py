@@ -1,44 +1,93 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel
-from typing import List
+from typing import Callable, List, Optional, Tuple
+from contextlib import asynccontextmanager
 import warnings
-import random
+import secrets
 import string
 import re
 import logging
+import asyncio
+import aiohttp
+import os
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 warnings.filterwarnings('ignore')
 
 # Database stuff
-from database import database, create_tables
+from database import engine, async_engine
 from auth_routes import auth_router
 from admin_routes import admin_router, user_router
 from dashboard_routes import dashboard_router, scans_router
-from cert_routes import router as cert_router
-from qr_routes import qr_router  
+from cert_routes import router as cert_router, production_cert_service
+from qr_routes import qr_router, qr_cert_service, scan_writer, UploadSizeLimitMiddleware
 
-from simple_detector import simple_predict
+from simple_detector import simple_predict, simple_predict_batch
+from batching import collect_batch
 
 
 
+# App lifespan: startup before the yield, shutdown after
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create tables and start workers on startup; release pools on shutdown"""
+    # Create tables and the admin user, unless the launcher already did so once
+    # before forking (workers would otherwise race on the same SQLite file)
+    from init_db import DB_INITIALIZED_ENV, init_database
+    if not os.getenv(DB_INITIALIZED_ENV):
+        init_database()  # This is not async
+    
+    # Detector batches run in a small process pool per uvicorn worker (not one
+    # process per core: every uvicorn worker would multiply that again)
+    predict_batcher.start(lambda: ProcessPoolExecutor(max_workers=PREDICT_PROCESSES))
+    qr_cert_service.start()
+    scan_writer.start()
+    
+    # One pooled HTTP client for outbound lookups (keep-alive, DNS cache)
+    app.state.http = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300),
+        timeout=aiohttp.ClientTimeout(total=5)
+    )
+    logger.info("✅ Simple detector API ready!")
+    
+    yield
+    
+    await app.state.http.close()
+    await predict_batcher.stop()
+    await production_cert_service.close()
+    await qr_cert_service.close()
+    await scan_writer.stop()
+    await async_engine.dispose()
+    engine.dispose()
+
 # Setup FastAPI
 app = FastAPI(
     title="ClickSafe API", 
     description="Multilingual Phishing Detection API with User Management and QR URL Safety Analysis",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stdout)
 logger = logging.getLogger(__name__)
 
+# Oversized QR uploads are refused from Content-Length alone (inside CORS, so the
+# 413 still carries CORS headers)
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # CORS setup - allow frontend to connect
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:5173", "http://localhost:5174", "http://localhost:5175", "http://localhost:5176", "http://localhost:5177", "http://localhost:5178", "http://localhost:5179", "http://localhost:5180", "http://localhost:3000"],
+    allow_origin_regex=r"^http://localhost(:\d+)?$|^http://127\.0\.0\.1(:\d+)?$",
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Keyset pagination cursor for /dashboard scan history
+    expose_headers=["X-Next-Before-Id"],
 )
 
 # Add all the routers
@@ -84,24 +133,91 @@ class PasswordStrengthResponse(BaseModel):
     strength_score: float
     strength_level: str
     feedback: str
-    suggestions: list
+    suggestions: Tuple[str, ...]
+
+# Suggestions returned by /password/check, built once
+_SUGGESTIONS_TOP3 = (
+    "Use at least 12 characters",
+    "Include uppercase and lowercase letters",
+    "Add numbers and special characters"
+)
+
+# Detector processes per uvicorn worker
+PREDICT_PROCESSES = int(os.getenv('PREDICT_PROCESSES', 2))
 
-# Database event handlers
-@app.on_event("startup")
-async def startup():
-    """Connect to database and create tables on startup"""
-    await database.connect()
-    create_tables()
+class MicroBatcher:
+    """Coalesce concurrent /predict calls into simple_predict_batch calls"""
     
-    # Create admin user if it doesn't exist
-    from init_db import create_admin_user
-    create_admin_user()  # This is not async
-    print("✅ Simple detector API ready!")
+    def __init__(self, max_batch_size: int = 16, max_latency_ms: float = 5):
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.queue = None
+        self._worker = None
+        self._executor = None
+        self._executor_factory = None
+    
+    def start(self, executor_factory: Optional[Callable[[], Executor]] = None):
+        """Create the queue and start the worker on the running loop
+        
+        Batches run on an executor made by executor_factory (recreated if its
+        process pool breaks), or the default thread pool when it is None.
+        """
+        self._executor_factory = executor_factory
+        self._executor = executor_factory() if executor_factory else None
+        self.queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Cancel the worker task and shut down the executor"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        if self._executor is not None:
+            self._executor.shutdown()
+        self._worker = None
+        self._executor = None
+        self.queue = None
+    
+    async def _run_batch(self, messages: List[str]) -> List[dict]:
+        """Run simple_predict_batch on the executor, replacing a broken process pool once"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, simple_predict_batch, messages)
+        except BrokenProcessPool as e:
+            # A worker process died (OOM kill, segfault); the pool is unusable from now on
+            logger.error("Prediction pool broken, recreating it: %s", e)
+            self._executor.shutdown(wait=False)
+            self._executor = self._executor_factory()
+            return await loop.run_in_executor(self._executor, simple_predict_batch, messages)
+    
+    async def predict(self, message: str) -> dict:
+        """Queue a message and wait for its batched prediction"""
+        if self.queue is None:
+            # Batcher not running (e.g. app used without startup) - predict inline
+            return simple_predict(message)
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((message, fut))
+        return await fut
+    
+    async def _run(self):
+        while True:
+            batch = await collect_batch(self.queue, self.max_batch_size, self.max_latency)
+            try:
+                results = await self._run_batch([message for message, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
 
-@app.on_event("shutdown")
-async def shutdown():
-    """Disconnect from database on shutdown"""
-    await database.disconnect()
+predict_batcher = MicroBatcher()
 
 @app.get("/")
 async def root():
@@ -111,6 +227,24 @@ async def root():
 async def health_check():
     return {"status": "healthy", "detector": "simple"}
 
+# Character classes for password strength checks (built once at import)
+_UPPER = frozenset(string.ascii_uppercase)
+_LOWER = frozenset(string.ascii_lowercase)
+_DIGIT = frozenset(string.digits)
+_SYMBOL = frozenset('!@#$%^&*(),.?":{}|<>')
+_COMMON_PATTERNS = re.compile(r'123|abc|password|qwerty', re.IGNORECASE)
+
+# OS-backed CSPRNG for password generation
+_rng = secrets.SystemRandom()
+
+# Password character pools for every include_* combination, keyed by a 4-bit mask
+_PASSWORD_SYMBOLS = "!@#$%^&*(),.?\":{}|<>"
+_POOL_PARTS = (string.ascii_lowercase, string.ascii_uppercase, string.digits, _PASSWORD_SYMBOLS)
+_POOLS = {
+    mask: ''.join(part for bit, part in enumerate(_POOL_PARTS) if mask & (1 << bit))
+    for mask in range(16)
+}
+
 def calculate_password_strength(password):
     """Calculate password strength using multiple criteria"""
     score = 0
@@ -126,40 +260,41 @@ def calculate_password_strength(password):
         score += 5
         feedback.append("Password is too short. Use at least 8 characters")
     
-    # Character variety checks
-    if re.search(r'[A-Z]', password):
+    # Character variety: dedupe once, then C-level disjointness checks per class
+    used = set(password)
+    has_upper = not used.isdisjoint(_UPPER)
+    has_lower = not used.isdisjoint(_LOWER)
+    has_digit = not used.isdisjoint(_DIGIT)
+    has_symbol = not used.isdisjoint(_SYMBOL)
+    
+    if has_upper:
         score += 20
     else:
         feedback.append("Add uppercase letters")
     
-    if re.search(r'[a-z]', password):
+    if has_lower:
         score += 20
     else:
         feedback.append("Add lowercase letters")
     
-    if re.search(r'\d', password):
+    if has_digit:
         score += 20
     else:
         feedback.append("Add numbers")
     
-    if re.search(r'[!@#$%^&*(),.?":{}|<>]', password):
+    if has_symbol:
         score += 15
     else:
         feedback.append("Add special characters")
     
     # Complexity bonus
-    char_types = sum([
-        bool(re.search(r'[A-Z]', password)),
-        bool(re.search(r'[a-z]', password)),
-        bool(re.search(r'\d', password)),
-        bool(re.search(r'[!@#$%^&*(),.?":{}|<>]', password))
-    ])
+    char_types = has_upper + has_lower + has_digit + has_symbol
     
     if char_types >= 4:
         score += 10
     
     # Common patterns penalty
-    if re.search(r'(123|abc|password|qwerty)', password.lower()):
+    if _COMMON_PATTERNS.search(password):
         score -= 20
         feedback.append("Avoid common patterns")
     
@@ -168,89 +303,65 @@ def calculate_password_strength(password):
 def generate_smart_password(length=12, include_uppercase=True, include_lowercase=True, 
                            include_numbers=True, include_symbols=True):
     """Generate a secure password with specified criteria"""
-    chars = ""
-    
-    if include_lowercase:
-        chars += string.ascii_lowercase
-    if include_uppercase:
-        chars += string.ascii_uppercase
-    if include_numbers:
-        chars += string.digits
-    if include_symbols:
-        chars += "!@#$%^&*(),.?\":{}|<>"
-    
-    if not chars:
-        chars = string.ascii_letters + string.digits
+    mask = include_lowercase | (include_uppercase << 1) | (include_numbers << 2) | (include_symbols << 3)
+    chars = _POOLS[mask] or (string.ascii_letters + string.digits)
     
     # Ensure at least one character from each required type
     password = []
     
     if include_lowercase and string.ascii_lowercase:
-        password.append(random.choice(string.ascii_lowercase))
+        password.append(secrets.choice(string.ascii_lowercase))
     if include_uppercase and string.ascii_uppercase:
-        password.append(random.choice(string.ascii_uppercase))
+        password.append(secrets.choice(string.ascii_uppercase))
     if include_numbers and string.digits:
-        password.append(random.choice(string.digits))
+        password.append(secrets.choice(string.digits))
     if include_symbols:
-        password.append(random.choice("!@#$%^&*(),.?\":{}|<>"))
+        password.append(secrets.choice(_PASSWORD_SYMBOLS))
     
-    # Fill the rest randomly
-    for _ in range(length - len(password)):
-        password.append(random.choice(chars))
+    # Fill the rest randomly in one batched draw
+    password.extend(_rng.choices(chars, k=max(0, length - len(password))))
     
     # Shuffle to avoid predictable patterns
-    random.shuffle(password)
+    _rng.shuffle(password)
     
     return ''.join(password)
 
-def predict_message(message: str) -> dict:
-    """Predict if a message is phishing using simple detector - for internal use"""
-    try:
-        if not message.strip():
-            raise ValueError("Message cannot be empty")
-        
-        # Use simple detector directly
-        from simple_detector import simple_predict
-        result = simple_predict(message.strip())
-        return result
-        
-    except Exception as e:
-        print(f"Prediction error: {str(e)}")
-        raise Exception(f"Prediction error: {str(e)}")
+async def _do_predict(message: str) -> dict:
+    """Validate a message and classify it with the simple detector"""
+    message = message.strip()
+    if not message:
+        raise ValueError("Message cannot be empty")
+    
+    # Use simple detector, batched with concurrent requests
+    return await predict_batcher.predict(message)
 
-@app.post("/predict", response_model=PredictionResponse)
+@app.post("/predict", response_model=PredictionResponse, response_class=ORJSONResponse)
 async def predict_message(request: MessageRequest):
     """Predict if a message is phishing using simple detector"""
     try:
-        message = request.message.strip()
-        if not message:
-            raise HTTPException(status_code=400, detail="Message cannot be empty")
-        
-        # Use simple detector
-        result = simple_predict(message)
-        
-        # Convert to response format
-        response = PredictionResponse(
-            text=message,
-            language=result["language"],
-            classification=result["classification"],
-            risk_score=result["risk_score"],
-            suspicious_terms=result["suspicious_terms"],
-            explanation=result["explanation"],
-            is_safe=result["is_safe"]
-        )
-        
-        return response
-        
+        result = await _do_predict(request.message)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"Prediction error: {str(e)}")
+        logger.error("Prediction error: %s", e)
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+    
+    # Convert to response format; detector output is trusted, so skip validation
+    return PredictionResponse.model_construct(
+        text=result["text"],
+        language=result["language"],
+        classification=result["classification"],
+        risk_score=float(result["risk_score"]),
+        suspicious_terms=result["suspicious_terms"],
+        explanation=result["explanation"],
+        is_safe=result["is_safe"]
+    )
 
 @app.post("/password/generate", response_model=PasswordResponse)
 async def generate_password(request: PasswordRequest):
     """Generate a secure password"""
     try:
-        print(f"Generating password with settings: {request}")
+        logger.debug("Generating password with settings: %s", request)
         
         password = generate_smart_password(
             length=request.length,
@@ -263,24 +374,24 @@ async def generate_password(request: PasswordRequest):
         # Calculate strength
         strength_score, feedback = calculate_password_strength(password)
         
-        result = PasswordResponse(
+        result = PasswordResponse.model_construct(
             password=password,
-            strength_score=strength_score,
+            strength_score=float(strength_score),
             feedback="; ".join(feedback) if feedback else "Strong password!"
         )
         
-        print(f"Generated password successfully: {result.password} (score: {result.strength_score})")
+        logger.debug("Generated password successfully (score: %s)", result.strength_score)
         return result
     
     except Exception as e:
-        print(f"Error generating password: {e}")
+        logger.error("Error generating password: %s", e)
         raise HTTPException(status_code=500, detail=f"Password generation error: {str(e)}")
 
 @app.post("/password/check", response_model=PasswordStrengthResponse)
 async def check_password_strength(request: PasswordCheckRequest):
     """Check password strength"""
     try:
-        print(f"Checking password strength for: {request.password[:3]}...")
+        logger.debug("Checking password strength")
         
         password = request.password
         strength_score, feedback = calculate_password_strength(password)
@@ -297,27 +408,19 @@ async def check_password_strength(request: PasswordCheckRequest):
         else:
             strength_level = "Very Weak"
         
-        suggestions = [
-            "Use at least 12 characters",
-            "Include uppercase and lowercase letters",
-            "Add numbers and special characters",
-            "Avoid common words and patterns",
-            "Consider using a passphrase"
-        ]
-        
-        result = PasswordStrengthResponse(
+        result = PasswordStrengthResponse.model_construct(
             password=password,
-            strength_score=strength_score,
+            strength_score=float(strength_score),
             strength_level=strength_level,
             feedback="; ".join(feedback) if feedback else "Good password!",
-            suggestions=suggestions[:3]
+            suggestions=_SUGGESTIONS_TOP3
         )
         
-        print(f"Password strength check complete: {strength_level} ({strength_score}/100)")
+        logger.debug("Password strength check complete: %s (%s/100)", strength_level, strength_score)
         return result
     
     except Exception as e:
-        print(f"Error checking password strength: {e}")
+        logger.error("Error checking password strength: %s", e)
         raise HTTPException(status_code=500, detail=f"Password checking error: {str(e)}")
 
 @app.get("/password/health")
@@ -332,6 +435,26 @@ async def password_health():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False)
+    from init_db import DB_INITIALIZED_ENV, init_database
+    
+    # Schema and admin user are set up once here, not in every worker
+    init_database()
+    os.environ[DB_INITIALIZED_ENV] = "1"
+    
+    reload = os.getenv("RELOAD", "false").lower() == "true"
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=reload,
+        # Reload mode only supports a single worker. One by default: SQLite
+        # serializes writes, and caches, queues and the VirusTotal quota are per process
+        workers=1 if reload else int(os.getenv("WORKERS", 1)),
+        # "auto" picks uvloop/httptools when installed (not available on Windows)
+        loop="auto",
+        http="auto",
+        access_log=False,
+        log_level="warning"
+    )
     
     
\ No newline at end of file
@@ -1,7 +1,7 @@
 """
 Database models for ClickSafe application
 """
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Float, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Float, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -65,6 +65,12 @@ class UserScan(Base):
     
     # Relationships
     user = relationship("User", back_populates="scans")
+    
+    __table_args__ = (
+        Index("ix_user_scans_user_created", "user_id", "created_at"),
+        Index("ix_user_scans_user_type_created", "user_id", "scan_type", "created_at"),
+        Index("ix_user_scans_classification", "classification"),
+    )
 
 class UserActivity(Base):
     """Track user activities for admin monitoring"""
@@ -83,6 +89,10 @@ class UserActivity(Base):
     
     # Relationships
     user = relationship("User", back_populates="activities")
+    
+    __table_args__ = (
+        Index("ix_user_activities_user_created", "user_id", "created_at"),
+    )
 
 class AdminLog(Base):
     """Log admin activities"""
@@ -102,6 +112,10 @@ class AdminLog(Base):
     # Relationships
     admin_user = relationship("User", foreign_keys=[admin_user_id])
     target_user = relationship("User", foreign_keys=[target_user_id])
+    
+    __table_args__ = (
+        Index("ix_admin_logs_admin_created", "admin_user_id", "created_at"),
+    )
 
 class RecentScam(Base):
     """Store recent high-risk scam messages for public display"""
@@ -3,16 +3,106 @@
 Handles real email sending with multiple provider support
 """
 import aiosmtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from email.message import EmailMessage
 from email.utils import formatdate
 import logging
 import asyncio
+import sys
+import html
+import json
+from functools import lru_cache
+from string import Template
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Report HTML; user-supplied fields are HTML-escaped before substitution
+_CERT_REPORT_HTML = """
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="UTF-8">
+            <style>
+                body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+                .header { background: ${threat_color}; color: white; padding: 20px; text-align: center; }
+                .content { padding: 20px; }
+                .threat-box { background: #ffebee; border: 2px solid ${threat_color}; padding: 15px; margin: 10px 0; }
+                .data-section { background: #f5f5f5; padding: 15px; margin: 10px 0; border-left: 4px solid #2196f3; }
+                .footer { background: #263238; color: white; padding: 15px; text-align: center; }
+            </style>
+        </head>
+        <body>
+            <div class="header">
+                <h1>🛡️ ClickSafe CERT Report</h1>
+                <h2>Phishing Threat Detection Alert</h2>
+            </div>
+            
+            <div class="content">
+                <div class="threat-box">
+                    <h2>${threat_level} THREAT DETECTED</h2>
+                    <p><strong>Risk Score:</strong> ${risk_score}%</p>
+                    <p><strong>Detection Time:</strong> ${timestamp}</p>
+                    <p><strong>Source:</strong> ClickSafe Mobile Application</p>
+                </div>
+                
+                <div class="data-section">
+                    <h3>� Malicious URL Details</h3>
+                    <p><strong>Detected URL:</strong></p>
+                    <pre style="background: white; padding: 10px; border: 1px solid #ddd; color: #d32f2f; font-weight: bold;">${url}</pre>
+                </div>
+                
+                <div class="data-section">
+                    <h3>�📱 Detected Content</h3>
+                    <p><strong>Suspicious Content/Message:</strong></p>
+                    <pre style="background: white; padding: 10px; border: 1px solid #ddd;">${detected_content}</pre>
+                </div>
+                
+                <div class="data-section">
+                    <h3>🔍 Threat Analysis</h3>
+                    <p><strong>Detection Method:</strong> AI-Powered Phishing Detection</p>
+                    <p><strong>Risk Level:</strong> ${risk_level}</p>
+                    <p><strong>Confidence Level:</strong> ${risk_score}%</p>
+                    <p><strong>Classification:</strong> ${classification}</p>
+                    <p><strong>Reported by User:</strong> ${user_email}</p>
+                    <p><strong>Comments:</strong> ${comments}</p>
+                </div>
+                
+                <div class="data-section">
+                    <h3>🎯 Recommended Actions</h3>
+                    <ul>
+                        <li>Investigate the source of this phishing attempt</li>
+                        <li>Add to threat intelligence databases</li>
+                        <li>Consider issuing public warning if widespread</li>
+                        <li>Monitor for similar attack patterns</li>
+                    </ul>
+                </div>
+            </div>
+            
+            <div class="footer">
+                <p><strong>ClickSafe - Protecting Sri Lankan Citizens from Cyber Threats</strong></p>
+                <p>This report was automatically generated by the ClickSafe security system</p>
+                <p>For questions contact: ClickSafe_Srilanka@outlook.com</p>
+            </div>
+        </body>
+        </html>
+        """
+
+# Only the span between the first and last placeholder varies per report; the
+# static head and tail are encoded to UTF-8 once and reused for every email
+_BODY_START = _CERT_REPORT_HTML.index("${")
+_BODY_END = _CERT_REPORT_HTML.index("}", _CERT_REPORT_HTML.rindex("${")) + 1
+_PREFIX_HTML = _CERT_REPORT_HTML[:_BODY_START]
+_SUFFIX_HTML = _CERT_REPORT_HTML[_BODY_END:]
+_PREFIX_BYTES = _PREFIX_HTML.encode('utf-8')
+_SUFFIX_BYTES = _SUFFIX_HTML.encode('utf-8')
+
+# The body is split around the detection time, so a cached render (which can't
+# include it) is two halves joined with the current timestamp
+_CERT_REPORT_BEFORE_TIMESTAMP, _CERT_REPORT_AFTER_TIMESTAMP = (
+    Template(part) for part in _CERT_REPORT_HTML[_BODY_START:_BODY_END].split("${timestamp}")
+)
+
 class ProductionCERTService:
     """Production-ready CERT email service with provider fallbacks"""
     
@@ -37,66 +127,119 @@ class ProductionCERTService:
         
         self.cert_email = "heshanrashmika9@gmail.com"  # Verify this email address
         self.current_config = self.gmail_config  # Default to Gmail
+        
+        # Long-lived SMTP session (STARTTLS + AUTH once), shared by all reports
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._smtp_lock = asyncio.Lock()
     
-    async def send_cert_report(self, threat_data: Dict[str, Any]) -> bool:
-        """Send professional CERT phishing report"""
+    async def send_cert_report(self, threat_data: Dict[str, Any], max_attempts: int = 3) -> bool:
+        """Send professional CERT phishing report, retrying with backoff
+        
+        Usually runs as a background task, so failures are only visible in the logs.
+        """
         try:
-            # Create professional email
-            msg = MIMEMultipart('alternative')
+            # Create professional email (single HTML part, no multipart envelope)
+            msg = EmailMessage()
             msg['From'] = self.current_config["sender_email"]
             msg['To'] = self.cert_email
             msg['Subject'] = f"🚨 URGENT: Phishing Threat Report - Risk Level {threat_data.get('risk_score', 0)}%"
             msg['Date'] = formatdate(localtime=True)
             
-            # Professional HTML content
-            html_content = self._create_professional_report(threat_data)
-            html_part = MIMEText(html_content, 'html')
-            msg.attach(html_part)
+            # Professional HTML content, assembled from pre-encoded segments
+            msg.set_content(
+                self._create_professional_report_bytes(threat_data),
+                maintype='text', subtype='html', cte='base64', params={'charset': 'utf-8'}
+            )
             
-            # Attempt to send
-            success = await self._send_email_async(msg)
+            # Attempt to send, backing off between retries
+            url = threat_data.get('url', 'unknown')
+            for attempt in range(1, max_attempts + 1):
+                if await self._send_email_async(msg):
+                    logger.info("✅ CERT report sent successfully to %s (url=%s, attempt=%d)", self.cert_email, url, attempt)
+                    return True
+                
+                logger.warning("CERT report send failed (url=%s, attempt=%d/%d)", url, attempt, max_attempts)
+                if attempt < max_attempts:
+                    await asyncio.sleep(2 ** attempt)
             
-            if success:
-                logger.info(f"✅ CERT report sent successfully to {self.cert_email}")
-                return True
-            else:
-                logger.error("❌ Failed to send CERT report")
-                return False
+            logger.error("❌ Failed to send CERT report after %d attempts (url=%s)", max_attempts, url)
+            return False
                 
         except Exception as e:
-            logger.error(f"❌ CERT email service error: {str(e)}")
+            logger.error("❌ CERT email service error: %s", e)
             return False
     
-    async def _send_email_async(self, message: MIMEMultipart) -> bool:
-        """Send email using async SMTP with working Gmail configuration"""
-        try:
-            print("📧 Sending CERT report via Gmail...")
-            print(f"   From: {self.current_config['sender_email']}")
-            print(f"   To: {self.cert_email}")
-            print(f"   Subject: {message['Subject']}")
-            
-            # Use working Gmail configuration with aiosmtplib
-            smtp_client = aiosmtplib.SMTP(
+    async def _get_smtp_client(self) -> aiosmtplib.SMTP:
+        """Return the persistent SMTP client, (re)connecting if needed"""
+        if self._smtp is None or not self._smtp.is_connected:
+            self._smtp = aiosmtplib.SMTP(
                 hostname=self.current_config["smtp_server"],
                 port=self.current_config["smtp_port"],
                 start_tls=True,
                 username=self.current_config["sender_email"],
                 password=self.current_config["sender_password"]
             )
+            await self._smtp.connect()
+        return self._smtp
+    
+    async def _send_email_async(self, message: EmailMessage) -> bool:
+        """Send email over the persistent Gmail SMTP session"""
+        try:
+            logger.debug(
+                "📧 Sending CERT report via Gmail (from=%s, to=%s, subject=%s)",
+                self.current_config['sender_email'], self.cert_email, message['Subject']
+            )
             
-            # Send the message using context manager
-            async with smtp_client:
-                await smtp_client.send_message(message)
+            # One message at a time per session; retry once if the server dropped us
+            async with self._smtp_lock:
+                try:
+                    smtp_client = await self._get_smtp_client()
+                    await smtp_client.send_message(message)
+                except aiosmtplib.SMTPServerDisconnected:
+                    self._smtp = None
+                    smtp_client = await self._get_smtp_client()
+                    await smtp_client.send_message(message)
             
-            print("✅ CERT email sent successfully!")
+            logger.debug("✅ CERT email sent successfully!")
             return True
             
         except Exception as e:
-            print(f"❌ SMTP Error: {str(e)}")
+            logger.error("❌ SMTP Error: %s", e)
+            self._smtp = None
             return False
     
+    async def close(self):
+        """Close the persistent SMTP session"""
+        if self._smtp is not None and self._smtp.is_connected:
+            try:
+                await self._smtp.quit()
+            except Exception as e:
+                logger.warning("SMTP quit failed: %s", e)
+        self._smtp = None
+    
     def _create_professional_report(self, threat_data: Dict[str, Any]) -> str:
         """Create professional HTML report for CERT"""
+        return _PREFIX_HTML + self._render_report_body(threat_data) + _SUFFIX_HTML
+    
+    def _create_professional_report_bytes(self, threat_data: Dict[str, Any]) -> bytes:
+        """Create the HTML report as UTF-8, encoding only the dynamic body"""
+        return _PREFIX_BYTES + self._render_report_body(threat_data).encode('utf-8') + _SUFFIX_BYTES
+    
+    def _render_report_body(self, threat_data: Dict[str, Any]) -> str:
+        """Render the dynamic part of the report (rendered once per distinct payload)"""
+        payload_json = json.dumps(
+            {k: v for k, v in threat_data.items() if k not in ('submission_time', 'timestamp')},
+            sort_keys=True, default=str
+        )
+        before, after = self._render_professional_report(payload_json)
+        return before + datetime.now().strftime("%Y-%m-%d %H:%M:%S") + after
+    
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _render_professional_report(payload_json: str) -> Tuple[str, str]:
+        """Render the dynamic report body for a JSON-normalized payload, as the
+        halves before and after the detection time"""
+        threat_data = json.loads(payload_json)
         risk_score = threat_data.get('risk_score', 0)
         
         # Extract URL and content properly
@@ -107,8 +250,6 @@ class ProductionCERTService:
         if not detected_content or detected_content.strip() == '':
             detected_content = f"Malicious URL detected: {url}"
         
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
         # Determine threat level
         if risk_score >= 90:
             threat_level = "🔴 CRITICAL"
@@ -126,77 +267,18 @@ class ProductionCERTService:
         user_email = threat_data.get('user_email', 'Anonymous')
         comments = threat_data.get('comments', 'No additional comments')
         
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .header {{ background: {threat_color}; color: white; padding: 20px; text-align: center; }}
-                .content {{ padding: 20px; }}
-                .threat-box {{ background: #ffebee; border: 2px solid {threat_color}; padding: 15px; margin: 10px 0; }}
-                .data-section {{ background: #f5f5f5; padding: 15px; margin: 10px 0; border-left: 4px solid #2196f3; }}
-                .footer {{ background: #263238; color: white; padding: 15px; text-align: center; }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>🛡️ ClickSafe CERT Report</h1>
-                <h2>Phishing Threat Detection Alert</h2>
-            </div>
-            
-            <div class="content">
-                <div class="threat-box">
-                    <h2>{threat_level} THREAT DETECTED</h2>
-                    <p><strong>Risk Score:</strong> {risk_score}%</p>
-                    <p><strong>Detection Time:</strong> {timestamp}</p>
-                    <p><strong>Source:</strong> ClickSafe Mobile Application</p>
-                </div>
-                
-                <div class="data-section">
-                    <h3>� Malicious URL Details</h3>
-                    <p><strong>Detected URL:</strong></p>
-                    <pre style="background: white; padding: 10px; border: 1px solid #ddd; color: #d32f2f; font-weight: bold;">{url}</pre>
-                </div>
-                
-                <div class="data-section">
-                    <h3>�📱 Detected Content</h3>
-                    <p><strong>Suspicious Content/Message:</strong></p>
-                    <pre style="background: white; padding: 10px; border: 1px solid #ddd;">{detected_content}</pre>
-                </div>
-                
-                <div class="data-section">
-                    <h3>🔍 Threat Analysis</h3>
-                    <p><strong>Detection Method:</strong> AI-Powered Phishing Detection</p>
-                    <p><strong>Risk Level:</strong> {risk_level}</p>
-                    <p><strong>Confidence Level:</strong> {risk_score}%</p>
-                    <p><strong>Classification:</strong> {classification}</p>
-                    <p><strong>Reported by User:</strong> {user_email}</p>
-                    <p><strong>Comments:</strong> {comments}</p>
-                </div>
-                
-                <div class="data-section">
-                    <h3>🎯 Recommended Actions</h3>
-                    <ul>
-                        <li>Investigate the source of this phishing attempt</li>
-                        <li>Add to threat intelligence databases</li>
-                        <li>Consider issuing public warning if widespread</li>
-                        <li>Monitor for similar attack patterns</li>
-                    </ul>
-                </div>
-            </div>
-            
-            <div class="footer">
-                <p><strong>ClickSafe - Protecting Sri Lankan Citizens from Cyber Threats</strong></p>
-                <p>This report was automatically generated by the ClickSafe security system</p>
-                <p>For questions contact: ClickSafe_Srilanka@outlook.com</p>
-            </div>
-        </body>
-        </html>
-        """
-        
-        return html_content
+        fields = dict(
+            threat_color=threat_color,
+            threat_level=threat_level,
+            risk_score=risk_score,
+            url=html.escape(str(url)),
+            detected_content=html.escape(str(detected_content)),
+            risk_level=html.escape(risk_level),
+            classification=html.escape(str(classification)),
+            user_email=html.escape(str(user_email)),
+            comments=html.escape(str(comments))
+        )
+        return _CERT_REPORT_BEFORE_TIMESTAMP.substitute(fields), _CERT_REPORT_AFTER_TIMESTAMP.substitute(fields)
 
     async def test_connection(self) -> bool:
         """Test email service connection"""
@@ -206,20 +288,20 @@ class ProductionCERTService:
             "timestamp": datetime.now().isoformat()
         }
         
-        print("🔄 Testing CERT email service...")
+        logger.info("🔄 Testing CERT email service...")
         result = await self.send_cert_report(test_data)
         
         if result:
-            print("✅ CERT email service is ready!")
-            print("🎯 System will send real emails when threats are detected")
+            logger.info("✅ CERT email service is ready! System will send real emails when threats are detected")
         else:
-            print("❌ CERT email service needs configuration")
+            logger.error("❌ CERT email service needs configuration")
             
         return result
 
 # Test the service
 if __name__ == "__main__":
-    import datetime
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stdout)
+    
     async def main():
         service = ProductionCERTService()
         await service.test_connection()
@@ -4,20 +4,173 @@ Dedicated service for handling QR code CERT reports with enhanced email function
 """
 import asyncio
 import aiosmtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from email.header import Header
 from email.utils import formatdate
+import base64
+import html
 import logging
+import sys
 from datetime import datetime
-from typing import Dict, Any, Optional
-import json
+from typing import Dict, Any, List, Literal, Optional, Tuple
+import zlib
+from string import Template
+import orjson
+
+def _dumps_indented(obj: Any) -> str:
+    """Pretty-print obj as JSON (datetimes serialize natively)"""
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS, default=str).decode()
+
+def _dumps_compact(obj: Any) -> bytes:
+    """Serialize obj as compact UTF-8 JSON"""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS, default=str)
 
 logger = logging.getLogger(__name__)
 
+# Email body content types per report format
+_CERT_CONTENT_TYPES = {
+    'html': 'text/html',
+    'json': 'application/json',
+    'text': 'text/plain'
+}
+
+# Fields listed, in order, in the plain-text report
+_TEXT_REPORT_FIELDS = (
+    'report_id', 'url', 'risk_score', 'risk_level', 'classification',
+    'confidence', 'content', 'reasoning', 'comments', 'submission_time'
+)
+
+# Gmail drops idle SMTP sessions after ~10 minutes; NOOP well inside that
+_SMTP_KEEPALIVE_SECONDS = 300
+
+# Delivery attempts per report before it is dropped (and logged as undeliverable)
+_MAX_SEND_ATTEMPTS = 5
+
+# Backoff after a batch with failures doubles from this, up to the maximum (seconds)
+_RETRY_BACKOFF_SECONDS = 5
+_RETRY_BACKOFF_MAX_SECONDS = 300
+
+# Full tracebacks are logged for one failure in this many; the rest get a one-liner
+_TRACEBACK_SAMPLE_RATE = 100
+
+# Fields a QR CERT report must carry (user_email removed for privacy)
+_REQUIRED_FIELDS = ('url', 'risk_score')
+
+# (minimum score, level) pairs used when a report arrives without a risk_level
+CERT_RISK_TIERS = ((80, 'critical'), (60, 'high'))
+
+# Report HTML; user-supplied fields are HTML-escaped before substitution
+_QR_CERT_REPORT_HTML = """
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="utf-8">
+            <title>QR Code Threat Report</title>
+            <style>
+                body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+                .header { background: ${risk_color}; color: white; padding: 20px; text-align: center; }
+                .content { padding: 20px; }
+                .section { margin-bottom: 20px; padding: 15px; border-left: 4px solid ${risk_color}; background: #f8f9fa; }
+                .label { font-weight: bold; color: #495057; }
+                .value { margin-left: 10px; }
+                .risk-badge { background: ${risk_color}; color: white; padding: 5px 10px; border-radius: 4px; font-weight: bold; }
+                .footer { background: #6c757d; color: white; padding: 15px; text-align: center; font-size: 12px; }
+                table { width: 100%; border-collapse: collapse; margin: 10px 0; }
+                th, td { padding: 8px; text-align: left; border-bottom: 1px solid #ddd; }
+                th { background-color: #f8f9fa; }
+            </style>
+        </head>
+        <body>
+            <div class="header">
+                <h1>🚨 QR Code Security Threat Report</h1>
+                <p>Submitted via ClickSafe Threat Detection System</p>
+            </div>
+            
+            <div class="content">
+                <div class="section">
+                    <h2>🎯 Threat Summary</h2>
+                    <table>
+                        <tr><td class="label">Malicious URL:</td><td><strong>${url}</strong></td></tr>
+                        <tr><td class="label">Risk Level:</td><td><span class="risk-badge">${risk_level}</span></td></tr>
+                        <tr><td class="label">Risk Score:</td><td><strong>${risk_score}%</strong></td></tr>
+                        <tr><td class="label">Classification:</td><td>${classification}</td></tr>
+                        <tr><td class="label">Confidence:</td><td>${confidence}</td></tr>
+                    </table>
+                </div>
+                
+                <div class="section">
+                    <h2>📋 Threat Description</h2>
+                    <p><strong>Content:</strong> ${content}</p>
+                    <p><strong>Analysis Reasoning:</strong> ${reasoning}</p>
+                    ${comments_html}
+                </div>
+                
+                <div class="section">
+                    <h2>🔍 Security Analysis</h2>
+                    <pre style="background: #f8f9fa; padding: 10px; border-radius: 4px; overflow-x: auto;">${security_analysis}</pre>
+                </div>
+                
+                <div class="section">
+                    <h2>� Submission Details</h2>
+                    <table>
+                        <tr><td class="label">Report ID:</td><td>${report_id}</td></tr>
+                        <tr><td class="label">Submitted Via:</td><td>ClickSafe Security Platform</td></tr>
+                        <tr><td class="label">Submission Time:</td><td>${submission_time}</td></tr>
+                    </table>
+                    <p style="font-size: 12px; color: #666; margin-top: 10px;">
+                        <em>Note: User identity protected for privacy. Contact ClickSafe for additional details if required for investigation.</em>
+                    </p>
+                </div>
+                
+                <div class="section">
+                    <h2>⚡ Recommended Actions</h2>
+                    ${recommended_actions}
+                </div>
+            </div>
+            
+            <div class="footer">
+                <p>This report was automatically generated by ClickSafe QR Code Security System</p>
+                <p>Generated on: ${generated_at} | Report ID: ${report_id}</p>
+            </div>
+        </body>
+        </html>
+        """
+
+_RISK_COLORS = {
+    'critical': '#dc3545',
+    'high': '#fd7e14',
+    'medium': '#ffc107'
+}
+
+# Recommended actions per risk tier, rendered once
+_ACTIONS = {
+    'critical': "<ul><li>🔴 <strong>CRITICAL:</strong> Immediate investigation and blocking recommended</li><li>📊 Add URL to threat intelligence databases</li><li>🚫 Consider domain blocking at infrastructure level</li></ul>",
+    'high': "<ul><li>🟠 <strong>HIGH RISK:</strong> Investigation recommended within 24 hours</li><li>📊 Monitor for similar patterns</li><li>⚠️ Consider user awareness alerts</li></ul>",
+    'medium': "<ul><li>🟡 <strong>MEDIUM RISK:</strong> Standard investigation procedures</li><li>📊 Add to monitoring systems</li><li>📝 Document for trend analysis</li></ul>"
+}
+
+# The head (styles) only varies by risk colour and the tail never varies, so
+# both are rendered and UTF-8 encoded once; only the body is built per report
+_BODY_START = _QR_CERT_REPORT_HTML.index("${url}")
+_BODY_END = _QR_CERT_REPORT_HTML.index("</body>")
+_HEAD_HTML_BY_TIER = {
+    tier: Template(_QR_CERT_REPORT_HTML[:_BODY_START]).substitute(risk_color=color)
+    for tier, color in _RISK_COLORS.items()
+}
+_HEAD_BYTES_BY_TIER = {tier: head.encode('utf-8') for tier, head in _HEAD_HTML_BY_TIER.items()}
+_TAIL_HTML = _QR_CERT_REPORT_HTML[_BODY_END:]
+_TAIL_BYTES = _TAIL_HTML.encode('utf-8')
+_QR_CERT_BODY_TMPL = Template(_QR_CERT_REPORT_HTML[_BODY_START:_BODY_END])
+
 class QRCERTService:
     """Dedicated QR CERT reporting service with robust email functionality"""
     
-    def __init__(self):
+    def __init__(self, cert_format: Literal["html", "json", "text"] = "html"):
+        # Email body format: the HTML report, or compact JSON / plain text for
+        # recipients that ingest reports automatically (skips HTML rendering)
+        if cert_format not in _CERT_CONTENT_TYPES:
+            raise ValueError(f"Unsupported CERT report format: {cert_format}")
+        self.cert_format = cert_format
+        
         # Gmail configuration (Primary) - Same as working phishing detection
         self.gmail_config = {
             "smtp_server": "smtp.gmail.com",
@@ -30,10 +183,184 @@ class QRCERTService:
         # ⚠️ IMPORTANT: Update this email address to where you want CERT reports sent
         self.cert_email = "heshanrashmika9@gmail.com"  # CERT recipient - CHANGE THIS TO YOUR PREFERRED EMAIL
         
-        print(f"[QR CERT] Service initialized")
-        print(f"   Sender: {self.gmail_config['sender_email']}")
-        print(f"   CERT Recipient: {self.cert_email}")
-        print(f"   NOTE: CERT reports will be sent to {self.cert_email}")
+        # Headers that never change for this sender/recipient pair, pre-encoded
+        self._static_headers = (
+            f"From: {self.gmail_config['sender_email']}\r\n"
+            f"To: {self.cert_email}\r\n"
+            "MIME-Version: 1.0\r\n"
+            f"Content-Type: {_CERT_CONTENT_TYPES[cert_format]}; charset=\"utf-8\"\r\n"
+            "Content-Transfer-Encoding: base64\r\n"
+        ).encode('ascii')
+        
+        # Long-lived SMTP session (STARTTLS + AUTH once), shared by all reports
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._smtp_lock = asyncio.Lock()
+        
+        # (report, failed attempts) waiting for delivery; drained by a single background worker
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=1000)
+        self._worker_task: Optional[asyncio.Task] = None
+        self._keepalive_task: Optional[asyncio.Task] = None
+        
+        # Failures seen so far, for sampling traceback logging
+        self._err_counter = 0
+        
+        logger.info("[QR CERT] Service initialized (sender=%s, recipient=%s)",
+                    self.gmail_config['sender_email'], self.cert_email)
+    
+    async def _get_smtp_client(self) -> aiosmtplib.SMTP:
+        """Return the persistent SMTP client, (re)connecting if it is gone
+        
+        Idle sessions are health-checked by _keepalive, not here. Callers must
+        hold self._smtp_lock.
+        """
+        if self._smtp is not None and self._smtp.is_connected:
+            return self._smtp
+        
+        smtp_client = aiosmtplib.SMTP(
+            hostname=self.gmail_config["smtp_server"],
+            port=self.gmail_config["smtp_port"],
+            start_tls=True,
+            username=self.gmail_config["sender_email"],
+            password=self.gmail_config["sender_password"]
+        )
+        await smtp_client.connect()
+        self._smtp = smtp_client
+        return smtp_client
+    
+    def _log_failure(self, message: str, exc: BaseException):
+        """Log a failure, with the traceback only for a 1-in-_TRACEBACK_SAMPLE_RATE sample"""
+        self._err_counter += 1
+        if self._err_counter % _TRACEBACK_SAMPLE_RATE == 1:
+            logger.exception("%s (failure #%d, traceback sampled)", message, self._err_counter)
+        else:
+            logger.error("%s: %s", message, exc)
+    
+    def start(self):
+        """Start the delivery worker and SMTP keepalive on the running loop (no-op if already running)"""
+        if self._worker_task is None or self._worker_task.done():
+            self._worker_task = asyncio.create_task(self._worker())
+        if self._keepalive_task is None or self._keepalive_task.done():
+            self._keepalive_task = asyncio.create_task(self._keepalive())
+    
+    async def _keepalive(self):
+        """Keep an idle SMTP session warm, dropping it as soon as the server does"""
+        while True:
+            await asyncio.sleep(_SMTP_KEEPALIVE_SECONDS)
+            async with self._smtp_lock:
+                if self._smtp is None:
+                    continue
+                try:
+                    await self._smtp.noop()
+                except Exception as e:
+                    logger.info("QR CERT SMTP session dropped while idle: %s", e)
+                    self._smtp = None
+    
+    async def _worker(self, max_batch: int = 50):
+        """Drain queued reports in batches over the shared SMTP session
+        
+        Failed reports are requeued up to _MAX_SEND_ATTEMPTS times; after a
+        batch with failures the worker backs off before draining again.
+        """
+        failed_batches = 0
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                failed, unsent = await self._send_batch(batch)
+            except Exception as e:
+                self._log_failure("QR CERT batch delivery exception", e)
+                failed, unsent = batch, []
+            
+            # Requeue before task_done() so close() keeps waiting for them
+            for report_data, attempts in failed:
+                self._requeue(report_data, attempts + 1)
+            for report_data, attempts in unsent:
+                self._requeue(report_data, attempts)
+            for _ in batch:
+                self._queue.task_done()
+            
+            if failed:
+                failed_batches += 1
+                delay = min(_RETRY_BACKOFF_SECONDS * 2 ** (failed_batches - 1), _RETRY_BACKOFF_MAX_SECONDS)
+                logger.warning("QR CERT delivery failing, retrying in %ds", delay)
+                await asyncio.sleep(delay)
+            else:
+                failed_batches = 0
+    
+    def _requeue(self, report_data: Dict[str, Any], attempts: int):
+        """Put a report back on the queue, or dead-letter it once it is out of attempts"""
+        if attempts >= _MAX_SEND_ATTEMPTS:
+            logger.error("❌ QR CERT report %s undeliverable after %d attempts, dropping: %s",
+                         report_data['report_id'], attempts, report_data['url'])
+            return
+        try:
+            self._queue.put_nowait((report_data, attempts))
+        except asyncio.QueueFull:
+            logger.error("❌ QR CERT queue full, dropping report %s: %s",
+                         report_data['report_id'], report_data['url'])
+    
+    async def _send_batch(self, batch: List[Tuple[Dict[str, Any], int]]) -> Tuple[list, list]:
+        """Send a batch of (report, attempts) entries under one SMTP session (one AUTH, N DATA)
+        
+        Returns (failed, unsent): the entries whose send failed, and the ones
+        not tried because a third of the batch had already failed.
+        """
+        # Build every message before taking the SMTP lock
+        messages = [(entry, self._build_msg(entry[0])) for entry in batch]
+        failed = []
+        
+        async with self._smtp_lock:
+            # Fetched once for the batch; only replaced after a send error
+            smtp_client = None
+            for index, (entry, msg) in enumerate(messages):
+                report_data = entry[0]
+                try:
+                    if smtp_client is None:
+                        smtp_client = await self._get_smtp_client()
+                    smtp_client = await self._send_message_locked(smtp_client, msg)
+                    logger.info("✅ QR CERT report %s sent to %s", report_data['report_id'], self.cert_email)
+                except Exception as e:
+                    self._smtp = smtp_client = None
+                    failed.append(entry)
+                    logger.error("❌ QR CERT report %s email failed (attempt %d): %s",
+                                 report_data['report_id'], entry[1] + 1, e)
+                    
+                    # The server is likely down; stop rather than burn the rest of the batch
+                    if len(failed) * 3 >= len(messages):
+                        return failed, [entry for entry, _ in messages[index + 1:]]
+        
+        return failed, []
+    
+    async def close(self, drain_timeout: float = 10.0):
+        """Flush queued reports (up to drain_timeout seconds), stop the worker and close the SMTP session"""
+        if self._worker_task is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Dropping %d unsent QR CERT reports on shutdown", self._queue.qsize())
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+        
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            try:
+                await self._keepalive_task
+            except asyncio.CancelledError:
+                pass
+            self._keepalive_task = None
+        
+        async with self._smtp_lock:
+            if self._smtp is not None and self._smtp.is_connected:
+                try:
+                    await self._smtp.quit()
+                except Exception as e:
+                    logger.warning("SMTP quit failed: %s", e)
+            self._smtp = None
     
     async def _test_email_connection(self) -> bool:
         """Test basic SMTP connection"""
@@ -67,137 +394,113 @@ class QRCERTService:
         Returns:
             Dictionary with submission status and details
         """
+        # Validate required fields first so rejected reports cost no further work
+        missing_fields = [field for field in _REQUIRED_FIELDS if not qr_data.get(field)]
+        if missing_fields:
+            error_msg = f"Missing required fields: {', '.join(missing_fields)}"
+            logger.warning("❌ QR CERT validation error: %s", error_msg)
+            return {
+                'success': False,
+                'error': error_msg,
+                'email_sent': False
+            }
+        
+        # One timestamp for the report ID, submission time and response
+        now = datetime.now()
+        submitted_at = now.isoformat()
+        
         try:
-            print(f"\n{'='*60}")
-            print(f"🚨 QR CERT REPORT SUBMISSION STARTING")
-            print(f"{'='*60}")
-            
-            # Log the incoming data
-            print(f"📊 QR Report Data:")
-            for key, value in qr_data.items():
-                if key == 'security_analysis':
-                    print(f"  {key}: {type(value).__name__} - {value}")
-                else:
-                    print(f"  {key}: {value}")
-            
-            # Validate required fields (removed user_email for privacy)
-            required_fields = ['url', 'risk_score']
-            missing_fields = [field for field in required_fields if not qr_data.get(field)]
-            
-            if missing_fields:
-                error_msg = f"Missing required fields: {', '.join(missing_fields)}"
-                print(f"❌ Validation Error: {error_msg}")
-                return {
-                    'success': False,
-                    'error': error_msg,
-                    'email_sent': False
-                }
+            logger.debug("🚨 QR CERT report submission (keys=%s)", list(qr_data))
             
             # Normalize and enhance the data
-            normalized_data = self._normalize_qr_data(qr_data)
-            print(f"\n📋 Normalized QR Data:")
-            for key, value in normalized_data.items():
-                print(f"  {key}: {value}")
+            normalized_data = self._normalize_qr_data(qr_data, now)
             
-            # Generate report ID
-            report_id = f"QR-{datetime.now().strftime('%Y%m%d%H%M%S')}-{abs(hash(normalized_data['url'])) % 10000:04d}"
+            # Generate report ID (crc32 is stable across processes, unlike hash())
+            report_id = f"QR-{now.strftime('%Y%m%d%H%M%S')}-{zlib.crc32(normalized_data['url'].encode('utf-8')) % 10000:04d}"
             normalized_data['report_id'] = report_id
             
-            print(f"\n🔖 Generated Report ID: {report_id}")
-            
-            # Create and send email
-            print(f"\n📧 ATTEMPTING EMAIL SENDING...")
-            email_result = await self._send_qr_cert_email(normalized_data)
-            
-            if email_result['success']:
-                print(f"✅ QR CERT EMAIL SENT SUCCESSFULLY!")
-                print(f"   Email ID: {email_result.get('email_id', 'N/A')}")
-                print(f"   Sent to: {self.cert_email}")
-                print(f"   Sent from: {self.gmail_config['sender_email']}")
-                
-                return {
-                    'success': True,
-                    'message': 'QR CERT report submitted successfully',
-                    'report_id': report_id,
-                    'email_sent': True,
-                    'email_details': email_result,
-                    'submitted_at': datetime.now().isoformat(),
-                    'recipient': self.cert_email
-                }
-            else:
-                print(f"❌ QR CERT EMAIL FAILED!")
-                print(f"   Error: {email_result.get('error', 'Unknown error')}")
-                
+            # Queue the email; the worker delivers it after we return
+            self.start()
+            try:
+                self._queue.put_nowait((normalized_data, 0))
+            except asyncio.QueueFull:
+                logger.error("❌ QR CERT queue full, rejecting report %s", report_id)
                 return {
                     'success': False,
-                    'message': 'QR CERT report processed but email delivery failed',
+                    'error': 'CERT report queue is full, please retry later',
+                    'queue_full': True,
                     'report_id': report_id,
                     'email_sent': False,
-                    'email_error': email_result.get('error', 'Unknown error'),
-                    'submitted_at': datetime.now().isoformat()
+                    'submitted_at': submitted_at
                 }
+            
+            return {
+                'success': True,
+                'message': 'QR CERT report queued for submission',
+                'report_id': report_id,
+                'email_sent': 'queued',
+                'submitted_at': submitted_at,
+                'recipient': self.cert_email
+            }
                 
         except Exception as e:
             error_msg = f"QR CERT Service error: {str(e)}"
-            print(f"💥 CRITICAL ERROR: {error_msg}")
-            logger.exception("QR CERT Service exception:")
+            self._log_failure("QR CERT Service exception", e)
             
             return {
                 'success': False,
                 'error': error_msg,
                 'email_sent': False,
-                'submitted_at': datetime.now().isoformat()
+                'submitted_at': submitted_at
             }
     
-    def _normalize_qr_data(self, report_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Normalize QR report data to consistent format"""
+    def _normalize_qr_data(self, report_data: Dict[str, Any], now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Normalize QR report data to consistent format (submission_time defaults to now)"""
         
-        # Extract URL (handle both old and new formats)
-        url = report_data.get('url') or report_data.get('qr_url', '')
+        # Keep the caller's submission time (datetime or ISO string) when it sent one
+        submission_time = report_data.get('submission_time') or now or datetime.now()
+        if isinstance(submission_time, str):
+            submission_time = datetime.fromisoformat(submission_time)
         
-        # Extract comments (handle both formats)
-        comments = report_data.get('comments') or report_data.get('user_comments', '')
+        # Extract URL and comments (handle both old and new formats)
+        url = report_data.get('url') or report_data.get('qr_url') or ''
+        comments = report_data.get('comments') or report_data.get('user_comments') or ''
         
-        # Extract risk information
+        # Extract risk information, deriving the level from the score if not provided
         risk_score = report_data.get('risk_score', 0)
-        risk_level = report_data.get('risk_level', '')
-        
-        # Derive risk level if not provided
-        if not risk_level:
-            if risk_score >= 80:
-                risk_level = 'critical'
-            elif risk_score >= 60:
-                risk_level = 'high'
-            else:
-                risk_level = 'medium'
+        risk_level = report_data.get('risk_level') or next(
+            (name for threshold, name in CERT_RISK_TIERS if risk_score >= threshold), 'medium'
+        )
         
-        # Extract classification
-        classification = report_data.get('classification', f'Malicious QR Code - {risk_level.title()} Risk')
+        # Defaults are only formatted for the fields the caller left out
+        classification = (
+            report_data['classification'] if 'classification' in report_data
+            else f'Malicious QR Code - {risk_level.title()} Risk'
+        )
         
-        # Extract confidence
         confidence = report_data.get('confidence')
         if confidence is None:
             confidence = min(risk_score / 100.0, 1.0)
         
-        # Create content description
-        content = report_data.get('content', f"QR code detected leading to: {url}")
-        if comments and comments not in content:
-            content += f". User comments: {comments}"
+        # Create content description, appending the user's comments if any
+        content = report_data.get('content') or f"QR code detected leading to: {url}"
+        if comments:
+            content = f"{content}. User comments: {comments}"
         
-        # Create reasoning
-        reasoning = report_data.get('reasoning', f"QR code analysis detected {risk_level} risk level with score {risk_score}/100")
+        reasoning = (
+            report_data['reasoning'] if 'reasoning' in report_data
+            else f"QR code analysis detected {risk_level} risk level with score {risk_score}/100"
+        )
         
         # Handle security analysis
-        security_analysis = report_data.get('security_analysis', {})
-        if not security_analysis:
-            security_analysis = {
-                'classification': classification,
-                'threat_indicators': {
-                    'suspicious_qr_code': True,
-                    'risk_level': risk_level,
-                    'malicious_url': risk_score >= 70
-                }
+        security_analysis = report_data.get('security_analysis') or {
+            'classification': classification,
+            'threat_indicators': {
+                'suspicious_qr_code': True,
+                'risk_level': risk_level,
+                'malicious_url': risk_score >= 70
             }
+        }
         
         return {
             'url': url,
@@ -209,68 +512,73 @@ class QRCERTService:
             'reasoning': reasoning,
             'security_analysis': security_analysis,
             'comments': comments,
-            'submission_time': datetime.now()
+            'submission_time': submission_time
             # User details removed for privacy protection
         }
     
+    def _subject(self, report_data: Dict[str, Any]) -> str:
+        """Email subject for a normalized report"""
+        return f"🚨 URGENT: QR Code Threat Report - Risk Level {report_data['risk_score']}%"
+    
+    def _build_msg(self, report_data: Dict[str, Any]) -> bytes:
+        """Build the raw CERT email for a normalized report
+        
+        Only Subject, Date and the body vary, so the message is assembled as
+        bytes around the precomputed headers rather than via email.mime.
+        """
+        if self.cert_format == 'json':
+            content = _dumps_compact(report_data)
+        elif self.cert_format == 'text':
+            content = "\n".join(
+                f"{field}: {report_data.get(field, '')}" for field in _TEXT_REPORT_FIELDS
+            ).encode('utf-8')
+        else:
+            content = self._create_qr_cert_html_report_bytes(report_data)
+        
+        subject = Header(self._subject(report_data), 'utf-8').encode(linesep='\r\n')
+        headers = (
+            f"Subject: {subject}\r\n"
+            f"Date: {formatdate(localtime=True)}\r\n\r\n"
+        ).encode('ascii')
+        body = base64.encodebytes(content).replace(b'\n', b'\r\n')
+        return self._static_headers + headers + body
+    
+    async def _send_message_locked(self, smtp_client: aiosmtplib.SMTP, msg: bytes) -> aiosmtplib.SMTP:
+        """Send on smtp_client; reopen the session once if the server dropped us
+        
+        Returns the client the message went out on. Callers must hold self._smtp_lock.
+        """
+        try:
+            await smtp_client.sendmail(self.gmail_config["sender_email"], [self.cert_email], msg)
+            return smtp_client
+        except (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPResponseException):
+            self._smtp = None
+            smtp_client = await self._get_smtp_client()
+            await smtp_client.sendmail(self.gmail_config["sender_email"], [self.cert_email], msg)
+            return smtp_client
+    
     async def _send_qr_cert_email(self, report_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Send QR CERT email with detailed logging and error handling"""
+        """Send a single QR CERT email immediately, bypassing the queue"""
         
         try:
-            print(f"📧 Creating QR CERT email...")
-            
-            # Create email message
-            msg = MIMEMultipart('alternative')
-            msg['From'] = self.gmail_config["sender_email"]
-            msg['To'] = self.cert_email
-            msg['Subject'] = f"🚨 URGENT: QR Code Threat Report - Risk Level {report_data['risk_score']}%"
-            msg['Date'] = formatdate(localtime=True)
-            
-            # Create HTML content
-            html_content = self._create_qr_cert_html_report(report_data)
-            html_part = MIMEText(html_content, 'html')
-            msg.attach(html_part)
-            
-            print(f"📧 Email created successfully")
-            print(f"   Subject: {msg['Subject']}")
-            print(f"   From: {msg['From']}")
-            print(f"   To: {msg['To']}")
-            
-            # Send email using aiosmtplib
-            print(f"📧 Connecting to Gmail SMTP...")
-            
-            smtp_client = aiosmtplib.SMTP(
-                hostname=self.gmail_config["smtp_server"],
-                port=self.gmail_config["smtp_port"],
-                start_tls=True,
-                username=self.gmail_config["sender_email"],
-                password=self.gmail_config["sender_password"]
-            )
-            
-            print(f"📧 SMTP client configured")
-            print(f"   Server: {self.gmail_config['smtp_server']}:{self.gmail_config['smtp_port']}")
-            print(f"   Username: {self.gmail_config['sender_email']}")
-            
-            # Send the message
-            async with smtp_client:
-                print(f"📧 Sending email...")
-                await smtp_client.send_message(msg)
-            
-            print(f"✅ QR CERT EMAIL SENT SUCCESSFULLY!")
+            msg = self._build_msg(report_data)
+            async with self._smtp_lock:
+                await self._send_message_locked(await self._get_smtp_client(), msg)
             
+            sent_at = datetime.now()
             return {
                 'success': True,
-                'email_id': f"qr-cert-{datetime.now().strftime('%Y%m%d%H%M%S')}",
+                'email_id': f"qr-cert-{sent_at.strftime('%Y%m%d%H%M%S')}",
                 'sent_to': self.cert_email,
                 'sent_from': self.gmail_config["sender_email"],
-                'subject': msg['Subject'],
-                'sent_at': datetime.now().isoformat()
+                'subject': self._subject(report_data),
+                'sent_at': sent_at.isoformat()
             }
             
         except Exception as e:
+            self._smtp = None
             error_msg = f"Email sending failed: {str(e)}"
-            print(f"❌ EMAIL ERROR: {error_msg}")
-            logger.exception("QR CERT email sending exception:")
+            self._log_failure("QR CERT email sending exception", e)
             
             return {
                 'success': False,
@@ -280,125 +588,69 @@ class QRCERTService:
     
     def _create_qr_cert_html_report(self, report_data: Dict[str, Any]) -> str:
         """Create professional HTML report for QR CERT submission"""
+        risk_tier, body = self._render_qr_cert_report_body(report_data)
+        return _HEAD_HTML_BY_TIER[risk_tier] + body + _TAIL_HTML
+    
+    def _create_qr_cert_html_report_bytes(self, report_data: Dict[str, Any]) -> bytes:
+        """Create the HTML report as UTF-8, encoding only the dynamic body"""
+        risk_tier, body = self._render_qr_cert_report_body(report_data)
+        return b"".join((_HEAD_BYTES_BY_TIER[risk_tier], body.encode('utf-8'), _TAIL_BYTES))
+    
+    def _render_qr_cert_report_body(self, report_data: Dict[str, Any]) -> Tuple[str, str]:
+        """Render the per-report part of the HTML report, returning (risk tier, body)
+        
+        report_data must come from _normalize_qr_data (submission_time is a datetime).
+        """
         
         risk_score = report_data.get('risk_score', 0)
-        risk_color = '#dc3545' if risk_score >= 80 else '#fd7e14' if risk_score >= 60 else '#ffc107'
+        risk_tier = next((name for threshold, name in CERT_RISK_TIERS if risk_score >= threshold), 'medium')
         
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <title>QR Code Threat Report</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .header {{ background: {risk_color}; color: white; padding: 20px; text-align: center; }}
-                .content {{ padding: 20px; }}
-                .section {{ margin-bottom: 20px; padding: 15px; border-left: 4px solid {risk_color}; background: #f8f9fa; }}
-                .label {{ font-weight: bold; color: #495057; }}
-                .value {{ margin-left: 10px; }}
-                .risk-badge {{ background: {risk_color}; color: white; padding: 5px 10px; border-radius: 4px; font-weight: bold; }}
-                .footer {{ background: #6c757d; color: white; padding: 15px; text-align: center; font-size: 12px; }}
-                table {{ width: 100%; border-collapse: collapse; margin: 10px 0; }}
-                th, td {{ padding: 8px; text-align: left; border-bottom: 1px solid #ddd; }}
-                th {{ background-color: #f8f9fa; }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>🚨 QR Code Security Threat Report</h1>
-                <p>Submitted via ClickSafe Threat Detection System</p>
-            </div>
-            
-            <div class="content">
-                <div class="section">
-                    <h2>🎯 Threat Summary</h2>
-                    <table>
-                        <tr><td class="label">Malicious URL:</td><td><strong>{report_data.get('url', 'N/A')}</strong></td></tr>
-                        <tr><td class="label">Risk Level:</td><td><span class="risk-badge">{report_data.get('risk_level', 'Unknown').upper()}</span></td></tr>
-                        <tr><td class="label">Risk Score:</td><td><strong>{risk_score}%</strong></td></tr>
-                        <tr><td class="label">Classification:</td><td>{report_data.get('classification', 'N/A')}</td></tr>
-                        <tr><td class="label">Confidence:</td><td>{report_data.get('confidence', 0):.2%}</td></tr>
-                    </table>
-                </div>
-                
-                <div class="section">
-                    <h2>📋 Threat Description</h2>
-                    <p><strong>Content:</strong> {report_data.get('content', 'N/A')}</p>
-                    <p><strong>Analysis Reasoning:</strong> {report_data.get('reasoning', 'N/A')}</p>
-                    {f"<p><strong>User Comments:</strong> {report_data.get('comments', 'None provided')}</p>" if report_data.get('comments') else ''}
-                </div>
-                
-                <div class="section">
-                    <h2>🔍 Security Analysis</h2>
-                    <pre style="background: #f8f9fa; padding: 10px; border-radius: 4px; overflow-x: auto;">{json.dumps(report_data.get('security_analysis', {}), indent=2)}</pre>
-                </div>
-                
-                <div class="section">
-                    <h2>� Submission Details</h2>
-                    <table>
-                        <tr><td class="label">Report ID:</td><td>{report_data.get('report_id', 'N/A')}</td></tr>
-                        <tr><td class="label">Submitted Via:</td><td>ClickSafe Security Platform</td></tr>
-                        <tr><td class="label">Submission Time:</td><td>{report_data.get('submission_time', datetime.now()).strftime('%Y-%m-%d %H:%M:%S UTC') if hasattr(report_data.get('submission_time', datetime.now()), 'strftime') else str(report_data.get('submission_time', datetime.now()))}</td></tr>
-                    </table>
-                    <p style="font-size: 12px; color: #666; margin-top: 10px;">
-                        <em>Note: User identity protected for privacy. Contact ClickSafe for additional details if required for investigation.</em>
-                    </p>
-                </div>
-                
-                <div class="section">
-                    <h2>⚡ Recommended Actions</h2>
-                    {"<ul>" + "".join([f"<li>🔴 <strong>CRITICAL:</strong> Immediate investigation and blocking recommended</li><li>📊 Add URL to threat intelligence databases</li><li>🚫 Consider domain blocking at infrastructure level</li>" if risk_score >= 80 else 
-                    "<li>🟠 <strong>HIGH RISK:</strong> Investigation recommended within 24 hours</li><li>📊 Monitor for similar patterns</li><li>⚠️ Consider user awareness alerts</li>" if risk_score >= 60 else
-                    "<li>🟡 <strong>MEDIUM RISK:</strong> Standard investigation procedures</li><li>📊 Add to monitoring systems</li><li>📝 Document for trend analysis</li>"]) + "</ul>"}
-                </div>
-            </div>
-            
-            <div class="footer">
-                <p>This report was automatically generated by ClickSafe QR Code Security System</p>
-                <p>Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')} | Report ID: {report_data.get('report_id', 'N/A')}</p>
-            </div>
-        </body>
-        </html>
-        """
+        comments = report_data.get('comments')
+        now = datetime.now()
         
-        return html
+        return risk_tier, _QR_CERT_BODY_TMPL.substitute(
+            url=html.escape(str(report_data.get('url', 'N/A'))),
+            risk_level=html.escape(str(report_data.get('risk_level', 'Unknown')).upper()),
+            risk_score=risk_score,
+            classification=html.escape(str(report_data.get('classification', 'N/A'))),
+            confidence=f"{report_data.get('confidence', 0):.2%}",
+            content=html.escape(str(report_data.get('content', 'N/A'))),
+            reasoning=html.escape(str(report_data.get('reasoning', 'N/A'))),
+            comments_html=f"<p><strong>User Comments:</strong> {html.escape(str(comments))}</p>" if comments else '',
+            security_analysis=html.escape(_dumps_indented(report_data.get('security_analysis', {}))),
+            report_id=html.escape(str(report_data.get('report_id', 'N/A'))),
+            submission_time=report_data['submission_time'].strftime('%Y-%m-%d %H:%M:%S UTC'),
+            generated_at=now.strftime('%Y-%m-%d %H:%M:%S UTC'),
+            recommended_actions=_ACTIONS[risk_tier]
+        )
     
     async def test_email_connection(self) -> Dict[str, Any]:
         """Test email connection and configuration"""
         try:
-            print(f"\n🔧 TESTING QR CERT EMAIL CONNECTION...")
-            print(f"   Server: {self.gmail_config['smtp_server']}:{self.gmail_config['smtp_port']}")
-            print(f"   Username: {self.gmail_config['sender_email']}")
+            logger.info("🔧 Testing QR CERT email connection (%s:%s)",
+                        self.gmail_config['smtp_server'], self.gmail_config['smtp_port'])
             
-            smtp_client = aiosmtplib.SMTP(
-                hostname=self.gmail_config["smtp_server"],
-                port=self.gmail_config["smtp_port"],
-                start_tls=True,
-                username=self.gmail_config["sender_email"],
-                password=self.gmail_config["sender_password"]
-            )
+            async with self._smtp_lock:
+                await self._get_smtp_client()
             
-            async with smtp_client:
-                print("✅ SMTP connection successful!")
-                return {'success': True, 'message': 'Email connection test passed'}
+            logger.info("✅ SMTP connection successful!")
+            return {'success': True, 'message': 'Email connection test passed'}
                 
         except Exception as e:
             error_msg = f"Email connection test failed: {str(e)}"
-            print(f"❌ SMTP connection failed: {error_msg}")
+            logger.error("❌ SMTP connection failed: %s", error_msg)
             return {'success': False, 'error': error_msg}
 
 # Test function
 async def test_qr_cert_service():
     """Test the QR CERT service with sample data"""
-    print("🧪 TESTING QR CERT SERVICE...")
+    logger.info("🧪 TESTING QR CERT SERVICE...")
     
     service = QRCERTService()
     
-    # Test connection first
+    # Test connection first (the service logs the failure itself)
     connection_result = await service.test_email_connection()
     if not connection_result['success']:
-        print(f"❌ Connection test failed: {connection_result['error']}")
         return
     
     # Test QR CERT submission
@@ -412,14 +664,14 @@ async def test_qr_cert_service():
     }
     
     result = await service.submit_qr_cert_report(sample_data)
+    await service.close()  # waits for the queued email to go out
     
     if result['success']:
-        print(f"\n🎉 QR CERT SERVICE TEST SUCCESSFUL!")
-        print(f"   Report ID: {result['report_id']}")
-        print(f"   Email Sent: {result['email_sent']}")
+        logger.info("🎉 QR CERT SERVICE TEST SUCCESSFUL! (report_id=%s, email_sent=%s)",
+                    result['report_id'], result['email_sent'])
     else:
-        print(f"\n❌ QR CERT SERVICE TEST FAILED!")
-        print(f"   Error: {result.get('error', 'Unknown error')}")
+        logger.error("❌ QR CERT SERVICE TEST FAILED! %s", result.get('error', 'Unknown error'))
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stdout)
     asyncio.run(test_qr_cert_service())
@@ -2,65 +2,250 @@
 QR Code Scanning API Routes
 Modern FastAPI implementation for QR URL safety analysis
 """
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File, Query, Request, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import func, insert
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, validator
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, Iterator, List
 import logging
+import ast
 from datetime import datetime
 import asyncio
 import os
+import aiohttp
+import orjson
+from uuid import uuid4
+from types import MappingProxyType
 
 # Local imports
-from database import get_db
+from database import get_db, SessionLocal, AsyncSessionLocal
+from batching import collect_batch
 from auth_routes import get_current_user
+from auth import verify_token_cached
 from models import User, UserScan
-from qr_service import QRURLSafetyService, convert_numpy_types
+from qr_service import QRURLSafetyService
 from production_cert_service import ProductionCERTService
-from qr_cert_service import QRCERTService
+from qr_cert_service import QRCERTService, CERT_RISK_TIERS
 
 qr_service = QRURLSafetyService()
 production_cert_service = ProductionCERTService()
 qr_cert_service = QRCERTService()
 
-# Models for QR analysis, convert_numpy_types
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 logger = logging.getLogger(__name__)
 
 # Initialize router
-qr_router = APIRouter(prefix="/api/qr", tags=["QR Scanner"])
+qr_router = APIRouter(prefix="/api/qr", tags=["QR Scanner"], default_response_class=ORJSONResponse)
 
 # Optional authentication dependency
 security = HTTPBearer(auto_error=False)
 
+# (minimum score, recommendation) used when an analysis returned no recommendations
+RECOMMENDATION_TIERS = (
+    (80, "⚠️ HIGH RISK: Exercise extreme caution with this URL"),
+    (60, "⚠️ CAUTION: Verify this URL before proceeding"),
+    (40, "⚠️ BE CAREFUL: Check website authenticity"),
+)
+SAFE_RECOMMENDATION = "✅ Appears relatively safe, but stay vigilant"
+
+# Read-only combined_assessment for scans whose safety analysis failed; copy() per response
+_FALLBACK_RECOMMENDATIONS = ["⚠️ CAUTION: Could not analyze URL completely", "Verify URL manually before proceeding"]
+_FALLBACK_ASSESSMENT = MappingProxyType({
+    "final_risk_score": 50,
+    "final_risk_level": "medium",
+    "confidence": 0.5,
+    "reasoning": "Unable to complete full analysis",
+    "threat_indicators": {},
+    "recommendation": _FALLBACK_RECOMMENDATIONS[0],  # Frontend expects singular
+    "recommendations": _FALLBACK_RECOMMENDATIONS  # Full array for completeness
+})
+
+def default_recommendation(risk_score: float) -> str:
+    """Recommendation for a risk score when the analysis supplied none"""
+    return next(
+        (message for threshold, message in RECOMMENDATION_TIERS if risk_score >= threshold),
+        SAFE_RECOMMENDATION
+    )
+
+# Largest accepted QR image upload, in bytes (10MB)
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', 10485760))
+
+# Allowance for multipart boundaries and part headers on top of the file itself
+UPLOAD_MULTIPART_OVERHEAD = 64 * 1024
+
+class UploadSizeLimitMiddleware:
+    """Reject QR image uploads by Content-Length before the body is received
+    
+    FastAPI parses multipart bodies before the endpoint runs, so the endpoint's
+    own size check only fires after the whole upload has been spooled.
+    """
+    
+    def __init__(self, app, path: str = "/api/qr/scan/image",
+                 max_size: int = UPLOAD_MAX_SIZE + UPLOAD_MULTIPART_OVERHEAD):
+        self.app = app
+        self.path = path
+        self.max_size = max_size
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == self.path:
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    if value.isdigit() and int(value) > self.max_size:
+                        response = ORJSONResponse(
+                            {"detail": f"File too large. Maximum size: {UPLOAD_MAX_SIZE / 1024 / 1024:.1f}MB"},
+                            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+                        )
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+def get_http_session(request: Request) -> Optional[aiohttp.ClientSession]:
+    """Shared HTTP session created in the app lifespan (None outside the app)"""
+    return getattr(request.app.state, "http", None)
+
+def dig(data: Any, *path: str, default: Any = None) -> Any:
+    """Follow a path of keys through nested dicts; default if any step is missing or None"""
+    for key in path:
+        if not isinstance(data, dict):
+            return default
+        data = data.get(key)
+        if data is None:
+            return default
+    return data
+
+def parse_recommendations(explanation: Optional[str]) -> List[str]:
+    """Recommendations stored in UserScan.explanation as a JSON list
+    
+    Older rows hold a Python list repr, which is parsed with ast.literal_eval;
+    anything else is treated as a single free-text recommendation.
+    """
+    if not explanation:
+        return []
+    if not explanation.startswith('['):
+        return [explanation]
+    try:
+        return orjson.loads(explanation)
+    except orjson.JSONDecodeError:
+        pass
+    try:
+        return ast.literal_eval(explanation)
+    except (ValueError, SyntaxError):
+        return [explanation]
+
+def persist_scan(values: Dict[str, Any]):
+    """Insert a UserScan row in its own session (runs as a background task)"""
+    db = SessionLocal()
+    try:
+        db.execute(insert(UserScan).values(**values))
+        db.commit()
+        logger.info(f"{values['scan_type']} scan saved to history for user {values['user_id']}")
+    except Exception as e:
+        logger.error(f"Failed to save {values['scan_type']} scan to history: {str(e)}")
+        db.rollback()
+    finally:
+        db.close()
+
+class ScanHistoryWriter:
+    """Coalesce UserScan inserts from concurrent requests into executemany batches"""
+    
+    def __init__(self, max_batch_size: int = 200, max_latency_ms: float = 50, max_pending: int = 10000):
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.max_pending = max_pending
+        self.queue = None
+        self._worker = None
+    
+    def start(self):
+        """Create the queue and start the flusher on the running loop"""
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self._worker = asyncio.create_task(self._run())
+    
+    async def stop(self, drain_timeout: float = 5.0):
+        """Flush pending rows (up to drain_timeout seconds), then cancel the flusher"""
+        if self._worker is not None:
+            try:
+                await asyncio.wait_for(self.queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Dropping %d unsaved scans on shutdown", self.queue.qsize())
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+        self.queue = None
+    
+    def submit(self, values: Dict[str, Any]) -> bool:
+        """Queue a UserScan row; False if the writer is not running or is full"""
+        if self.queue is None:
+            return False
+        try:
+            self.queue.put_nowait(values)
+        except asyncio.QueueFull:
+            return False
+        return True
+    
+    async def _run(self):
+        while True:
+            batch = await collect_batch(self.queue, self.max_batch_size, self.max_latency)
+            try:
+                await self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+    
+    async def _write_batch(self, batch: List[Dict[str, Any]]):
+        """Insert the batch in one transaction; if that fails, insert row by row
+        
+        One bad row fails the whole executemany, so the fallback keeps the
+        rest of the batch and only loses the rows that fail on their own.
+        """
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(insert(UserScan), batch)
+                await db.commit()
+            return
+        except Exception as e:
+            logger.warning("Batch insert of %d scans failed, retrying row by row: %s", len(batch), e)
+        
+        async with AsyncSessionLocal() as db:
+            for values in batch:
+                try:
+                    await db.execute(insert(UserScan).values(**values))
+                    await db.commit()
+                except Exception as e:
+                    await db.rollback()
+                    logger.error("Failed to save %s scan to history for user %s: %s",
+                                 values.get('scan_type'), values.get('user_id'), e)
+
+scan_writer = ScanHistoryWriter()
+
 async def get_current_user_optional(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
     db: Session = Depends(get_db)
 ) -> Optional[User]:
-    """Get current authenticated user (optional)"""
-    if not credentials:
+    """Get current authenticated user (optional)
+    
+    Invalid or expired tokens yield None (verify_token_cached returns None
+    on JWT errors), so no exception handling is needed on the anonymous path.
+    """
+    if not credentials or credentials.scheme.lower() != "bearer":
         return None
     
-    try:
-        from auth import verify_token
-        token = credentials.credentials
-        payload = verify_token(token)
-        
-        if payload is None or payload.get("type") != "access":
-            return None
-        
-        user_id = payload.get("sub")
-        if user_id is None:
-            return None
-        
-        user = db.query(User).filter(User.id == user_id).first()
-        if user and user.is_active:
-            return user
-    except:
-        pass
+    payload = verify_token_cached(credentials.credentials)
+    if payload is None or payload.get("type") != "access":
+        return None
+    
+    user_id = payload.get("sub")
+    if user_id is None:
+        return None
     
+    user = db.query(User).filter(User.id == user_id).first()
+    if user and user.is_active:
+        return user
     return None
 
 # Request/Response Models
@@ -115,9 +300,10 @@ class ScanHistoryResponse(BaseModel):
 
 @qr_router.post("/scan/image", response_model=QRImageUploadResponse)
 async def scan_qr_image(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional)
+    current_user: Optional[User] = Depends(get_current_user_optional),
+    http_session: Optional[aiohttp.ClientSession] = Depends(get_http_session)
 ):
     """
     Upload and analyze QR code from image
@@ -136,9 +322,9 @@ async def scan_qr_image(
                 detail="File must be an image (PNG, JPEG, JPG, GIF, BMP, WEBP)"
             )
         
-        # Check file size (10MB limit)
-        max_size = int(os.getenv('UPLOAD_MAX_SIZE', 10485760))  # 10MB
-        file_content = await file.read()
+        # Check file size (10MB limit); reading one byte past the cap is enough to reject
+        max_size = UPLOAD_MAX_SIZE
+        file_content = await file.read(max_size + 1)
         
         if len(file_content) > max_size:
             raise HTTPException(
@@ -146,48 +332,40 @@ async def scan_qr_image(
                 detail=f"File too large. Maximum size: {max_size / 1024 / 1024:.1f}MB"
             )
         
-        # Reset file pointer
-        await file.seek(0)
-        file_content = await file.read()
-        
         user_identifier = current_user.email if current_user else "anonymous"
         logger.info(f"Processing QR image upload from user {user_identifier}")
         
         # Scan QR code and analyze URL
-        result = await qr_service.scan_qr_from_image(file_content)
+        result = await qr_service.scan_qr_from_image(file_content, http_session)
         
-        # Generate scan ID for tracking
-        if current_user:
-            scan_id = f"qr-{datetime.now().strftime('%Y%m%d%H%M%S')}-{abs(hash(current_user.email)) % 10000:04d}"
-        else:
-            scan_id = f"qr-{datetime.now().strftime('%Y%m%d%H%M%S')}-anon"
+        # One timestamp for the scan ID and response
+        now = datetime.now()
+        
+        # Generate scan ID for tracking (random suffix is unique across workers)
+        scan_id = f"qr-{now.strftime('%Y%m%d%H%M%S')}-{uuid4().hex[:6]}"
         
-        # Save scan to database for history (only for authenticated users)
+        # Save scan to database for history (only for authenticated users), batched with
+        # other requests' scans; written after the response if the writer isn't running
         if current_user and result["success"]:
-            try:
-                decoded_url = result.get('qr_detection', {}).get('decoded_url', '')
-                safety_analysis = result.get('safety_analysis', {})
-                
-                qr_scan = UserScan(
-                    user_id=current_user.id,
-                    scan_type='qr_code',
-                    content=decoded_url,
-                    original_content=decoded_url,
-                    classification=safety_analysis.get('risk_level', 'unknown'),
-                    risk_score=float(safety_analysis.get('risk_score', 0)),
-                    language='url',  # URLs don't have language, use 'url' as identifier
-                    suspicious_terms=safety_analysis.get('features', {}),
-                    explanation=str(safety_analysis.get('recommendations', []))
-                )
-                db.add(qr_scan)
-                db.commit()
-                logger.info(f"QR scan saved to history for user {current_user.email}")
-            except Exception as e:
-                logger.error(f"Failed to save QR scan to history: {str(e)}")
-                db.rollback()
+            decoded_url = dig(result, 'qr_detection', 'decoded_url', default='')
+            safety_analysis = result.get('safety_analysis', {})
+            
+            scan_values = dict(
+                user_id=current_user.id,
+                scan_type='qr_code',
+                content=decoded_url,
+                original_content=decoded_url,
+                classification=safety_analysis.get('risk_level', 'unknown'),
+                risk_score=float(safety_analysis.get('risk_score', 0)),
+                language='url',  # URLs don't have language, use 'url' as identifier
+                suspicious_terms=safety_analysis.get('features', {}),
+                explanation=orjson.dumps(safety_analysis.get('recommendations', [])).decode()
+            )
+            if not scan_writer.submit(scan_values):
+                background_tasks.add_task(persist_scan, scan_values)
         
         if result["success"]:
-            logger.info(f"QR scan successful for user {user_identifier}: {result.get('qr_detection', {}).get('decoded_url', 'Unknown URL')}")
+            logger.info(f"QR scan successful for user {user_identifier}: {dig(result, 'qr_detection', 'decoded_url', default='Unknown URL')}")
         else:
             logger.warning(f"QR scan failed for user {user_identifier}: {result.get('message')}")
         
@@ -198,52 +376,29 @@ async def scan_qr_image(
             "qr_detection": result.get("qr_detection"),
             "safety_analysis": result.get("safety_analysis"),
             "scan_id": scan_id,
-            "processed_at": datetime.now()
+            "processed_at": now
         }
         
         # Add combined_assessment for frontend compatibility
-        if result.get("safety_analysis"):
-            safety = result["safety_analysis"]
+        safety = result.get("safety_analysis")
+        if safety:
             risk_score = safety.get("risk_score", 30)  # Default to medium risk
-            risk_level = safety.get("risk_level", "medium")  # Default to medium
             
-            # Ensure we have valid recommendations based on risk score
-            recommendations = safety.get("recommendations", [])
-            if not recommendations:
-                # Generate default recommendations based on risk score
-                if risk_score >= 80:
-                    recommendations = ["⚠️ HIGH RISK: Exercise extreme caution with this URL"]
-                elif risk_score >= 60:
-                    recommendations = ["⚠️ CAUTION: Verify this URL before proceeding"]
-                elif risk_score >= 40:
-                    recommendations = ["⚠️ BE CAREFUL: Check website authenticity"]
-                else:
-                    recommendations = ["✅ Appears relatively safe, but stay vigilant"]
+            # Recommendations are never empty: fall back to one based on risk score
+            recommendations = safety.get("recommendations") or [default_recommendation(risk_score)]
             
             response_data["combined_assessment"] = {
                 "final_risk_score": risk_score,
-                "final_risk_level": risk_level,
-                "confidence": safety.get("ml_prediction", {}).get("confidence", 0.5) if safety.get("ml_prediction") else 0.5,
-                "reasoning": safety.get("ml_prediction", {}).get("prediction", "Analysis completed") if safety.get("ml_prediction") else "Analysis completed",
+                "final_risk_level": safety.get("risk_level", "medium"),  # Default to medium
+                "confidence": dig(safety, "ml_prediction", "confidence", default=0.5),
+                "reasoning": dig(safety, "ml_prediction", "prediction", default="Analysis completed"),
                 "threat_indicators": safety.get("features", {}),
-                "recommendation": recommendations[0] if recommendations else "Unknown recommendation",  # Frontend expects singular
+                "recommendation": recommendations[0],  # Frontend expects singular
                 "recommendations": recommendations  # Full array for completeness
             }
         else:
             # Provide default assessment when safety analysis fails
-            fallback_recommendations = ["⚠️ CAUTION: Could not analyze URL completely", "Verify URL manually before proceeding"]
-            response_data["combined_assessment"] = {
-                "final_risk_score": 50,
-                "final_risk_level": "medium",
-                "confidence": 0.5,
-                "reasoning": "Unable to complete full analysis",
-                "threat_indicators": {},
-                "recommendation": fallback_recommendations[0],  # Frontend expects singular
-                "recommendations": fallback_recommendations  # Full array for completeness
-            }
-        
-        # Convert any remaining numpy types to native Python types
-        response_data = convert_numpy_types(response_data)
+            response_data["combined_assessment"] = _FALLBACK_ASSESSMENT.copy()
         
         return QRImageUploadResponse(
             success=response_data["success"],
@@ -252,7 +407,7 @@ async def scan_qr_image(
             safety_analysis=response_data.get("safety_analysis"),
             combined_assessment=response_data.get("combined_assessment"),
             scan_id=scan_id,
-            processed_at=datetime.now()
+            processed_at=now
         )
         
     except HTTPException:
@@ -267,8 +422,9 @@ async def scan_qr_image(
 @qr_router.post("/scan/url", response_model=URLAnalysisResponse)
 async def analyze_url_direct(
     request: URLAnalysisRequest,
-    db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional)
+    background_tasks: BackgroundTasks,
+    current_user: Optional[User] = Depends(get_current_user_optional),
+    http_session: Optional[aiohttp.ClientSession] = Depends(get_http_session)
 ):
     """
     Analyze URL safety directly without QR code
@@ -281,34 +437,30 @@ async def analyze_url_direct(
         logger.info(f"Direct URL analysis requested by {user_identifier}: {request.url}")
         
         # Analyze URL safety
-        analysis = await qr_service.analyze_url_safety(request.url)
+        analysis = await qr_service.analyze_url_safety(request.url, http_session)
         
-        # Generate scan ID
-        if current_user:
-            scan_id = f"url-{datetime.now().strftime('%Y%m%d%H%M%S')}-{abs(hash(current_user.email)) % 10000:04d}"
-        else:
-            scan_id = f"url-{datetime.now().strftime('%Y%m%d%H%M%S')}-anon"
+        # One timestamp for the scan ID and response
+        now = datetime.now()
+        
+        # Generate scan ID (random suffix is unique across workers)
+        scan_id = f"url-{now.strftime('%Y%m%d%H%M%S')}-{uuid4().hex[:6]}"
         
-        # Save to database if requested (only for authenticated users)
+        # Save to database if requested (only for authenticated users), batched with
+        # other requests' scans; written after the response if the writer isn't running
         if current_user and request.save_to_history and analysis:
-            try:
-                url_scan = UserScan(
-                    user_id=current_user.id,
-                    scan_type='url',
-                    content=request.url,
-                    original_content=request.url,
-                    classification=analysis.get('risk_level', 'unknown'),
-                    risk_score=float(analysis.get('risk_score', 0)),
-                    language='url',
-                    suspicious_terms=analysis.get('features', {}),
-                    explanation=str(analysis.get('recommendations', []))
-                )
-                db.add(url_scan)
-                db.commit()
-                logger.info(f"URL analysis saved to history for user {current_user.email}")
-            except Exception as e:
-                logger.error(f"Failed to save URL analysis to history: {str(e)}")
-                db.rollback()
+            scan_values = dict(
+                user_id=current_user.id,
+                scan_type='url',
+                content=request.url,
+                original_content=request.url,
+                classification=analysis.get('risk_level', 'unknown'),
+                risk_score=float(analysis.get('risk_score', 0)),
+                language='url',
+                suspicious_terms=analysis.get('features', {}),
+                explanation=orjson.dumps(analysis.get('recommendations', [])).decode()
+            )
+            if not scan_writer.submit(scan_values):
+                background_tasks.add_task(persist_scan, scan_values)
         
         logger.info(f"URL analysis completed for {user_identifier}: Risk score {analysis.get('risk_score', 'unknown')}")
         
@@ -317,8 +469,8 @@ async def analyze_url_direct(
         combined_assessment = {
             "final_risk_score": analysis.get("risk_score", 0),
             "final_risk_level": analysis.get("risk_level", "unknown"),
-            "confidence": analysis.get("ml_prediction", {}).get("confidence", 0.5) if analysis.get("ml_prediction") else 0.5,
-            "reasoning": analysis.get("ml_prediction", {}).get("prediction", "Analysis completed") if analysis.get("ml_prediction") else "Analysis completed",
+            "confidence": dig(analysis, "ml_prediction", "confidence", default=0.5),
+            "reasoning": dig(analysis, "ml_prediction", "prediction", default="Analysis completed"),
             "threat_indicators": analysis.get("features", {}),
             "recommendation": recommendations[0] if recommendations else "No specific recommendation available",  # Frontend expects singular
             "recommendations": recommendations  # Full array for completeness
@@ -331,11 +483,7 @@ async def analyze_url_direct(
             "analyzed_at": analysis.get("analyzed_at")
         }
         
-        # Convert numpy types to native Python types
-        combined_assessment = convert_numpy_types(combined_assessment)
-        url_analysis = convert_numpy_types(url_analysis)
-        analysis = convert_numpy_types(analysis)
-        
+        # qr_service already returns native Python types, so no numpy conversion here
         return URLAnalysisResponse(
             success=True,
             message="URL analysis completed successfully",
@@ -343,7 +491,7 @@ async def analyze_url_direct(
             combined_assessment=combined_assessment,
             url_analysis=url_analysis,
             scan_id=scan_id,
-            processed_at=datetime.now()
+            processed_at=now
         )
         
     except Exception as e:
@@ -353,10 +501,58 @@ async def analyze_url_direct(
             detail="Internal server error during URL analysis"
         )
 
+# History pages larger than this are streamed row by row instead of buffered
+STREAM_HISTORY_PAGE_SIZE = 100
+
+# Largest history page a client may ask for
+MAX_HISTORY_PAGE_SIZE = 1000
+
+# The only UserScan columns /scan/history reads (skips original_content etc.)
+SCAN_HISTORY_COLUMNS = (
+    UserScan.id, UserScan.scan_type, UserScan.content, UserScan.risk_score,
+    UserScan.classification, UserScan.explanation, UserScan.created_at, UserScan.suspicious_terms
+)
+
+def scan_history_item(scan) -> Dict[str, Any]:
+    """One /scan/history entry for a row of SCAN_HISTORY_COLUMNS"""
+    return {
+        "id": scan.id,
+        "scan_type": scan.scan_type,
+        "content": scan.content,
+        "risk_score": scan.risk_score,
+        "classification": scan.classification,
+        "risk_level": scan.classification,  # For frontend compatibility
+        "recommendations": parse_recommendations(scan.explanation),
+        "scanned_at": scan.created_at.isoformat(),
+        "features": scan.suspicious_terms or {}
+    }
+
+def stream_scan_history(db: Session, first_row, rows: Iterator, total_count: int,
+                        page: int, page_size: int) -> Iterator[bytes]:
+    """Yield a ScanHistoryResponse as JSON, one row at a time from the DB cursor
+    
+    The query already ran (and produced first_row) before the response started,
+    so query errors still become a 500. The stream owns db and closes it. A plain
+    generator, so Starlette iterates it (and the sync session) in its threadpool.
+    """
+    try:
+        yield b'{"scans":['
+        if first_row is not None:
+            yield orjson.dumps(scan_history_item(first_row))
+            for row in rows:
+                yield b',' + orjson.dumps(scan_history_item(row))
+        yield b'],"total_count":%d,"page":%d,"page_size":%d}' % (total_count, page, page_size)
+    except Exception as e:
+        # Headers are already sent; abort the response rather than end it as valid JSON
+        logger.error(f"Scan history stream failed mid-response: {str(e)}")
+        raise
+    finally:
+        db.close()
+
 @qr_router.get("/scan/history", response_model=ScanHistoryResponse)
 async def get_scan_history(
-    page: int = 1,
-    page_size: int = 20,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=MAX_HISTORY_PAGE_SIZE),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -370,33 +566,42 @@ async def get_scan_history(
         # Query user's scan history
         offset = (page - 1) * page_size
         
-        # Get total count
-        total_count = db.query(UserScan).filter(
+        history_filter = (
             UserScan.user_id == current_user.id,
             UserScan.scan_type.in_(['qr_code', 'url'])
-        ).count()
+        )
         
-        # Get paginated results
-        scans = db.query(UserScan).filter(
-            UserScan.user_id == current_user.id,
-            UserScan.scan_type.in_(['qr_code', 'url'])
-        ).order_by(UserScan.created_at.desc()).offset(offset).limit(page_size).all()
+        # Get paginated results, with the total count as a window over the same filter
+        def history_query(session: Session):
+            return session.query(*SCAN_HISTORY_COLUMNS, func.count().over().label('total')).filter(
+                *history_filter
+            ).order_by(UserScan.created_at.desc()).offset(offset).limit(page_size)
+        
+        def count_without_rows(session: Session) -> int:
+            # Page past the end: no rows to carry the window count
+            return session.query(UserScan).filter(*history_filter).count() if offset else 0
+        
+        if page_size > STREAM_HISTORY_PAGE_SIZE:
+            # The stream outlives this handler (and get_db's session), so it gets its own
+            # session; the query runs here so that failures are still reported as a 500
+            stream_db = SessionLocal()
+            try:
+                rows = iter(history_query(stream_db).yield_per(100))
+                first_row = next(rows, None)
+                total_count = first_row.total if first_row is not None else count_without_rows(stream_db)
+            except Exception:
+                stream_db.close()
+                raise
+            return StreamingResponse(
+                stream_scan_history(stream_db, first_row, rows, total_count, page, page_size),
+                media_type="application/json"
+            )
+        
+        rows = history_query(db).all()
+        total_count = rows[0].total if rows else count_without_rows(db)
         
         # Convert to response format
-        scan_list = []
-        for scan in scans:
-            scan_data = {
-                "id": scan.id,
-                "scan_type": scan.scan_type,
-                "content": scan.content,
-                "risk_score": scan.risk_score,
-                "classification": scan.classification,
-                "risk_level": scan.classification,  # For frontend compatibility
-                "recommendations": eval(scan.explanation) if scan.explanation.startswith('[') else [scan.explanation],
-                "scanned_at": scan.created_at.isoformat(),
-                "features": scan.suspicious_terms or {}
-            }
-            scan_list.append(scan_data)
+        scan_list = [scan_history_item(row) for row in rows]
         
         return ScanHistoryResponse(
             scans=scan_list,
@@ -608,12 +813,9 @@ async def submit_qr_cert_report(
         
         if not risk_level:
             # Derive risk level from score if not provided
-            if risk_score >= 80:
-                risk_level = "critical"
-            elif risk_score >= 60:
-                risk_level = "high"
-            else:
-                risk_level = "medium"
+            risk_level = next(
+                (name for threshold, name in CERT_RISK_TIERS if risk_score >= threshold), "medium"
+            )
         
         if confidence is None:
             # Derive confidence from risk score if not provided
@@ -635,8 +837,10 @@ async def submit_qr_cert_report(
             )
         
         # Prepare report data - EXACTLY same structure as phishing detection (using normalized data)
-        content = report.content or f"QR code detected leading to: {qr_url}. User comments: {user_comments or 'None provided'}"
+        # QRCERTService appends the user comments to the content
+        content = report.content or f"QR code detected leading to: {qr_url}"
         reasoning = report.reasoning or f"QR code analysis detected {risk_level} risk level with score {risk_score}/100"
+        now = datetime.now()
         
         report_data = {
             'url': qr_url,
@@ -650,15 +854,21 @@ async def submit_qr_cert_report(
             'comments': user_comments,
             'user_email': current_user.email,
             'submitted_by': current_user.full_name or current_user.username,
-            'submission_time': datetime.now()
+            'submission_time': now
         }
         
         # Log the report attempt - EXACTLY same as phishing detection
         logger.info(f"QR CERT report submission attempt by {current_user.email} for URL: {qr_url}")
         
-        # Send email to CERT using dedicated QR CERT service
+        # Queue the CERT email; QRCERTService's worker delivers it after we respond
         cert_result = await qr_cert_service.submit_qr_cert_report(report_data)
         
+        if cert_result.get('queue_full'):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=cert_result['error']
+            )
+        
         if not cert_result.get('success') or not cert_result.get('email_sent'):
             logger.error(f"QR CERT submission failed: {cert_result.get('error', 'Email delivery failed')}")
             raise HTTPException(
@@ -666,20 +876,20 @@ async def submit_qr_cert_report(
                 detail=f"Failed to send report to CERT: {cert_result.get('error', 'Email delivery failed')}"
             )
         
-        # Generate report ID for tracking - same pattern with QR prefix
-        report_id = f"QR-{datetime.now().strftime('%Y%m%d')}-{abs(hash(qr_url)) % 10000:04d}"
+        # Report ID assigned by the service (the one in the CERT email)
+        report_id = cert_result['report_id']
         
         # Log successful submission - EXACTLY same as phishing detection
-        logger.info(f"QR CERT report {report_id} successfully submitted for URL: {qr_url}")
+        logger.info(f"QR CERT report {report_id} queued for URL: {qr_url}")
         
         # TODO: Store report in database for tracking
         # This could be implemented later for report history and analytics
         
         return QRCERTReportResponse(
             success=True,
-            message="QR threat report successfully submitted to Sri Lanka CERT. You will receive a confirmation email shortly.",
+            message="QR threat report queued for submission to Sri Lanka CERT. You will receive a confirmation email shortly.",
             report_id=report_id,
-            submitted_at=datetime.now()
+            submitted_at=now
         )
         
     except HTTPException:
@@ -737,12 +947,18 @@ async def submit_qr_cert_report_v2(
         # Use the dedicated QR CERT service
         result = await qr_cert_service.submit_qr_cert_report(service_data)
         
+        if result.get('queue_full'):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=result['error']
+            )
+        
         if result['success'] and result['email_sent']:
             logger.info(f"✅ QR CERT V2: Report {result['report_id']} submitted successfully")
             
             return QRCERTReportResponse(
                 success=True,
-                message="QR threat report successfully submitted to Sri Lanka CERT using dedicated service. Email confirmation sent.",
+                message="QR threat report queued for submission to Sri Lanka CERT using dedicated service.",
                 report_id=result['report_id'],
                 submitted_at=datetime.fromisoformat(result['submitted_at'])
             )
@@ -2,14 +2,21 @@
 Modern QR URL Safety Analysis Service
 Advanced QR code scanning with ML-based URL safety prediction
 """
+import io
 import os
-import pickle
 import asyncio
 import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, Optional, List, Tuple
+from functools import lru_cache
+from ipaddress import ip_address
+from typing import Dict, Any, Optional, List, NamedTuple, Tuple
 from urllib.parse import urlparse
 import hashlib
+import string
 import base64
 
 # Core dependencies
@@ -18,57 +25,186 @@ import numpy as np
 from PIL import Image
 import pyzbar.pyzbar as pyzbar
 import tldextract
-import requests
 import aiohttp
 from dotenv import load_dotenv
 
-# ML dependencies
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.preprocessing import LabelEncoder
-
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Analyses of recently seen URLs are reused for this long (seconds)
+_URL_CACHE_TTL = 300
+_URL_CACHE_MAX_SIZE = 10000
+
+# Decoded QR code (or None) per image content hash, least recently used first;
+# mobile clients often retry the same upload
+_IMAGE_CACHE_MAX_SIZE = 512
+_image_cache: "OrderedDict[bytes, Optional[Any]]" = OrderedDict()
+
+# cv2.QRCodeDetector instances are not thread-safe, so each decode thread keeps its own
+_detector_local = threading.local()
+
+class DecodedQR(NamedTuple):
+    """A decoded QR code, shaped like pyzbar's Decoded (data, type, rect)"""
+    data: bytes
+    type: str
+    rect: pyzbar.Rect
+
+# VirusTotal verdicts per URL are reused for a day
+_VT_CACHE_TTL = 24 * 60 * 60
+
+# VirusTotal quota (public API keys allow 4 requests per minute). The bucket is
+# per process: with several uvicorn workers, set this to the key's quota / WORKERS
+_VT_REQUESTS_PER_MINUTE = int(os.getenv('VT_REQUESTS_PER_MINUTE', 4))
+_VT_MAX_RETRIES = 3
+
+# Longest a scan waits for quota before skipping VirusTotal (seconds)
+_VT_MAX_TOKEN_WAIT = 3.0
+
+# Per-request VirusTotal timeout, independent of the session's default
+_VT_TIMEOUT = aiohttp.ClientTimeout(total=15)
+
+# Waits before each poll of a submitted VirusTotal analysis (seconds)
+_VT_POLL_DELAYS = (0.25, 0.5, 1.0, 2.0, 4.0)
+
+class _TokenBucket:
+    """Async token bucket allowing `rate` acquisitions per `period` seconds, with bursts up to `rate`"""
+    
+    def __init__(self, rate: int, period: float):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / period
+        self.updated = time.monotonic()
+    
+    async def acquire(self, max_wait: float = 0.0) -> bool:
+        """Take a token, waiting up to max_wait seconds for one; False (and no token) if that's not enough
+        
+        Waiting callers reserve their token up front (the balance goes negative),
+        so tokens are handed out in arrival order without a lock.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+        
+        wait = (1 - self.tokens) / self.fill_rate
+        if wait > max_wait:
+            return False
+        self.tokens -= 1
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
+
+_vt_limiter = _TokenBucket(_VT_REQUESTS_PER_MINUTE, 60)
+
+# Threads for blocking image decoding (PIL/OpenCV/zbar release the GIL for most of it)
+_DECODE_POOL = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="qr-decode")
+
+# Values that may need converting; anything else is returned as is
+_NUMPY_OR_CONTAINER = (np.generic, np.ndarray, dict, list, tuple)
+
 def convert_numpy_types(obj):
-    """Convert numpy types to native Python types for JSON serialization"""
-    if isinstance(obj, dict):
+    """Convert numpy types to native Python types for JSON serialization
+    
+    Containers holding only built-in scalars are returned unchanged (not copied).
+    """
+    t = type(obj)
+    if t is dict:
+        if not any(isinstance(value, _NUMPY_OR_CONTAINER) for value in obj.values()):
+            return obj
         return {key: convert_numpy_types(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
+    elif t is list:
+        if not any(isinstance(item, _NUMPY_OR_CONTAINER) for item in obj):
+            return obj
         return [convert_numpy_types(item) for item in obj]
-    elif isinstance(obj, tuple):
+    elif t is tuple:
         return tuple(convert_numpy_types(item) for item in obj)
-    elif isinstance(obj, (np.integer, np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32, np.uint64)):
-        return int(obj)
-    elif isinstance(obj, (np.floating, np.float16, np.float32, np.float64)):
-        return float(obj)
+    elif isinstance(obj, np.generic):  # Any numpy scalar (ints, floats, bool_, ...)
+        return obj.item()
     elif isinstance(obj, np.ndarray):
         return obj.tolist()
-    elif isinstance(obj, (np.bool_, np.bool8)):
-        return bool(obj)
-    elif hasattr(obj, 'item') and callable(obj.item):  # Any numpy scalar type
-        try:
-            return obj.item()
-        except:
-            pass
-    elif hasattr(obj, 'tolist') and callable(obj.tolist):
-        try:
-            return obj.tolist()
-        except:
-            pass
-    elif str(type(obj)).startswith("<class 'numpy."):  # Catch any remaining numpy types
-        try:
-            return obj.item() if hasattr(obj, 'item') else obj.tolist() if hasattr(obj, 'tolist') else int(obj)
-        except:
-            try:
-                return float(obj)
-            except:
-                return str(obj)
+    elif isinstance(obj, dict):  # dict subclasses
+        return {key: convert_numpy_types(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_numpy_types(item) for item in obj]
     else:
         return obj
 
+# Public Suffix List from tldextract's bundled snapshot: no network fetch on the
+# first scan, loaded lazily on first use
+_tld_extract = tldextract.TLDExtract(suffix_list_urls=(), include_psl_private_domains=False)
+
+# Substrings that commonly appear in phishing URLs
+_SUSPICIOUS_KEYWORDS = frozenset([
+    'secure', 'account', 'update', 'verify', 'login', 'signin',
+    'banking', 'paypal', 'amazon', 'microsoft', 'google',
+    'free', 'win', 'prize', 'urgent', 'suspend', 'limited'
+])
+
+def _is_ip_address(netloc: str) -> bool:
+    """Check if netloc's host is an IPv4 or IPv6 address"""
+    host = netloc.rpartition('@')[2]  # Ignore any user:password@ prefix
+    if host.startswith('['):
+        host = host[1:host.find(']')]
+    else:
+        host = host.split(':', 1)[0]
+    try:
+        ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+def _has_suspicious_keywords(url: str) -> bool:
+    """Check for suspicious keywords in URL"""
+    # One lowercase copy, then C-level substring searches; for this short list
+    # that beats a single regex alternation (and it runs once per distinct URL)
+    url_lower = url.lower()
+    return any(keyword in url_lower for keyword in _SUSPICIOUS_KEYWORDS)
+
+# URL punctuation that doesn't count as a "special" character (nor do alphanumerics)
+_URL_SAFE_CHARS = frozenset('.-_~:/?#[]@!$&\'()*+,;=')
+
+# Bytes deleted before counting special characters in ASCII URLs
+_URL_ALLOWED_BYTES = (string.ascii_letters + string.digits + ''.join(sorted(_URL_SAFE_CHARS))).encode('ascii')
+
+def _count_special_chars(url: str) -> int:
+    """Count characters that are neither alphanumeric nor URL punctuation"""
+    if url.isascii():
+        # One C-level pass: delete the allowed bytes and count what is left
+        return len(url.encode('ascii').translate(None, _URL_ALLOWED_BYTES))
+    return sum(1 for c in url if not c.isalnum() and c not in _URL_SAFE_CHARS)
+
+@lru_cache(maxsize=4096)
+def _extract_url_features_cached(url: str) -> Dict[str, Any]:
+    """Extract comprehensive features from URL (pure, so memoized per URL)"""
+    try:
+        parsed = urlparse(url)
+        extracted = _tld_extract(url)
+        
+        # Basic URL features
+        features = {
+            "url_length": len(url),
+            "domain_length": len(parsed.netloc),
+            "path_length": len(parsed.path),
+            "query_length": len(parsed.query or ""),
+            "subdomain_count": len(extracted.subdomain.split('.')) if extracted.subdomain else 0,
+            "domain_has_numbers": any(map(str.isdigit, extracted.domain)),
+            "url_has_ip": _is_ip_address(parsed.netloc),
+            "is_https": parsed.scheme == 'https',
+            "has_suspicious_keywords": _has_suspicious_keywords(url),
+            "domain_age_days": 0,  # Would need WHOIS lookup
+            "special_char_count": _count_special_chars(url),
+            "tld": extracted.suffix,
+            "domain": extracted.domain,
+            "subdomain": extracted.subdomain
+        }
+        
+        return features
+        
+    except Exception as e:
+        logger.error(f"❌ Feature extraction error: {str(e)}")
+        return {"error": str(e)}
+
 class QRURLSafetyService:
     """
     Modern QR URL Safety Analysis Service
@@ -90,6 +226,13 @@ class QRURLSafetyService:
         self.model_path = os.getenv('MODEL_PATH', 'qr_url_safety_model.pkl')
         self.debug = os.getenv('DEBUG', 'false').lower() == 'true'
         
+        # URL -> (expiry, analysis), least recently used first; plus analyses in progress
+        self._url_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._url_inflight: Dict[str, asyncio.Task] = {}
+        
+        # sha256(url) -> VirusTotal lookup, shared by concurrent callers and kept for _VT_CACHE_TTL
+        self._vt_cache: Dict[str, asyncio.Task] = {}
+        
         # Initialize the service
         self._load_model()
         
@@ -107,34 +250,21 @@ class QRURLSafetyService:
         logger.info("🔄 Creating fallback components for basic QR scanning")
         self.model_loaded = False
     
-    async def scan_qr_from_image(self, image_data: bytes) -> Dict[str, Any]:
+    async def scan_qr_from_image(self, image_data: bytes, http_session: Optional[aiohttp.ClientSession] = None) -> Dict[str, Any]:
         """
         Scan QR code from image data
         
         Args:
             image_data: Raw image bytes
+            http_session: Shared HTTP session for external lookups
             
         Returns:
             Dict containing QR detection results and safety analysis
         """
         try:
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(image_data))
-            
-            # Convert PIL image to RGB if needed
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Convert to numpy array
-            image_array = np.array(image)
-            
-            # Convert to OpenCV format (RGB to BGR)
-            cv_image = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
-            
-            # Detect QR codes
-            qr_codes = pyzbar.decode(cv_image)
+            qr_code = await self._decode_first_qr_code(image_data)
             
-            if not qr_codes:
+            if qr_code is None:
                 return {
                     "success": False,
                     "message": "No QR code found in image",
@@ -142,12 +272,10 @@ class QRURLSafetyService:
                     "safety_analysis": None
                 }
             
-            # Process first QR code found
-            qr_code = qr_codes[0]
             decoded_url = qr_code.data.decode('utf-8')
             
             # Analyze URL safety
-            safety_analysis = await self.analyze_url_safety(decoded_url)
+            safety_analysis = await self.analyze_url_safety(decoded_url, http_session)
             
             result = {
                 "success": True,
@@ -157,17 +285,17 @@ class QRURLSafetyService:
                     "decoded_url": decoded_url,
                     "qr_type": qr_code.type,
                     "position": {
-                        "x": int(int(qr_code.rect.left)),  # Force native Python int
-                        "y": int(int(qr_code.rect.top)),
-                        "width": int(int(qr_code.rect.width)),
-                        "height": int(int(qr_code.rect.height))
+                        "x": int(qr_code.rect.left),  # Force native Python int
+                        "y": int(qr_code.rect.top),
+                        "width": int(qr_code.rect.width),
+                        "height": int(qr_code.rect.height)
                     }
                 },
                 "safety_analysis": safety_analysis
             }
             
-            # Convert numpy types to native Python types
-            return convert_numpy_types(result)
+            # safety_analysis is already converted by analyze_url_safety
+            return result
             
         except Exception as e:
             logger.error(f"❌ QR scanning error: {str(e)}")
@@ -178,19 +306,106 @@ class QRURLSafetyService:
                 "safety_analysis": None
             }
             
-            # Convert numpy types to native Python types
-            return convert_numpy_types(result)
+            return result
+    
+    async def _decode_first_qr_code(self, image_data: bytes) -> Optional[Any]:
+        """Return the first QR code in the image (None if there is none), cached by content hash"""
+        key = hashlib.blake2b(image_data, digest_size=16).digest()
+        if key in _image_cache:
+            _image_cache.move_to_end(key)
+            return _image_cache[key]
+        
+        # Decoding is CPU-bound; run it off the event loop
+        loop = asyncio.get_running_loop()
+        qr_codes = await loop.run_in_executor(_DECODE_POOL, self._decode_qr_codes, image_data)
+        qr_code = qr_codes[0] if qr_codes else None
+        
+        # Only touched from the event loop thread, so no lock is needed
+        _image_cache[key] = qr_code
+        if len(_image_cache) > _IMAGE_CACHE_MAX_SIZE:
+            _image_cache.popitem(last=False)
+        return qr_code
+    
+    def _decode_qr_codes(self, image_data: bytes) -> list:
+        """Decode all QR codes in raw image bytes (blocking; run in _DECODE_POOL)"""
+        # Decode straight to grayscale (zbar only scans luminance anyway)
+        image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        
+        # Formats OpenCV can't read (e.g. GIF) go through PIL
+        if image is None:
+            image = np.asarray(Image.open(io.BytesIO(image_data)).convert('L'))
+        
+        # Detect QR codes with OpenCV's detector; zbar still catches what it misses
+        qr_codes = self._detect_qr_codes_cv2(image)
+        return qr_codes or pyzbar.decode(image)
     
-    async def analyze_url_safety(self, url: str) -> Dict[str, Any]:
+    def _detect_qr_codes_cv2(self, image: np.ndarray) -> List[DecodedQR]:
+        """Detect and decode QR codes in a grayscale image with cv2.QRCodeDetector"""
+        detector = getattr(_detector_local, "detector", None)
+        if detector is None:
+            detector = _detector_local.detector = cv2.QRCodeDetector()
+        
+        ok, decoded, points, _ = detector.detectAndDecodeMulti(image)
+        if not ok:
+            return []
+        
+        qr_codes = []
+        for text, corners in zip(decoded, points):
+            if not text:  # Located but not decodable
+                continue
+            left, top = corners.min(axis=0)
+            right, bottom = corners.max(axis=0)
+            qr_codes.append(DecodedQR(
+                data=text.encode('utf-8'),
+                type='QRCODE',
+                rect=pyzbar.Rect(int(left), int(top), int(right - left), int(bottom - top))
+            ))
+        return qr_codes
+    
+    async def analyze_url_safety(self, url: str, http_session: Optional[aiohttp.ClientSession] = None) -> Dict[str, Any]:
         """
         Analyze URL safety using ML model and external services
         
+        Results are cached per URL for _URL_CACHE_TTL seconds, and concurrent
+        requests for the same URL share one analysis. Callers must not mutate
+        the returned dict.
+        
         Args:
             url: URL to analyze
+            http_session: Shared HTTP session for external lookups
             
         Returns:
             Dict containing safety analysis results
         """
+        cached = self._url_cache.get(url)
+        if cached is not None and cached[0] > time.monotonic():
+            self._url_cache.move_to_end(url)
+            return cached[1]
+        
+        task = self._url_inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._analyze_url_uncached(url, http_session))
+            self._url_inflight[url] = task
+            task.add_done_callback(lambda done, url=url: self._cache_url_result(url, done))
+        
+        # Shielded so one caller disconnecting doesn't cancel the others' analysis
+        return await asyncio.shield(task)
+    
+    def _cache_url_result(self, url: str, task: asyncio.Task):
+        """Store a finished analysis (failed analyses are not cached)"""
+        self._url_inflight.pop(url, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        result = task.result()
+        if "error" in result:
+            return
+        self._url_cache[url] = (time.monotonic() + _URL_CACHE_TTL, result)
+        self._url_cache.move_to_end(url)
+        if len(self._url_cache) > _URL_CACHE_MAX_SIZE:
+            self._url_cache.popitem(last=False)
+    
+    async def _analyze_url_uncached(self, url: str, http_session: Optional[aiohttp.ClientSession] = None) -> Dict[str, Any]:
+        """Run the full URL analysis (see analyze_url_safety)"""
         try:
             # Extract URL features
             features = self._extract_url_features(url)
@@ -199,7 +414,7 @@ class QRURLSafetyService:
             ml_prediction = None  # self._predict_url_safety(url, features) if self.model_loaded else None
             
             # VirusTotal analysis (if API key available)
-            vt_analysis = await self._virustotal_analysis(url) if self.virustotal_api_key else None
+            vt_analysis = await self._virustotal_analysis(url, http_session) if self.virustotal_api_key else None
             
             # Combine results
             risk_score = self._calculate_risk_score(ml_prediction, vt_analysis, features)
@@ -215,7 +430,7 @@ class QRURLSafetyService:
                 "analyzed_at": datetime.now().isoformat()
             }
             
-            # Convert numpy types to native Python types
+            # The one numpy -> native conversion for the whole analysis (cached with it)
             return convert_numpy_types(result)
             
         except Exception as e:
@@ -228,39 +443,11 @@ class QRURLSafetyService:
                 "analyzed_at": datetime.now().isoformat()
             }
             
-            # Convert numpy types to native Python types
-            return convert_numpy_types(result)
+            return result
     
     def _extract_url_features(self, url: str) -> Dict[str, Any]:
-        """Extract comprehensive features from URL"""
-        try:
-            parsed = urlparse(url)
-            extracted = tldextract.extract(url)
-            
-            # Basic URL features
-            features = {
-                "url_length": len(url),
-                "domain_length": len(parsed.netloc),
-                "path_length": len(parsed.path),
-                "query_length": len(parsed.query or ""),
-                "subdomain_count": len(extracted.subdomain.split('.')) if extracted.subdomain else 0,
-                "domain_has_numbers": any(c.isdigit() for c in extracted.domain),
-                "url_has_ip": self._is_ip_address(parsed.netloc),
-                "is_https": parsed.scheme == 'https',
-                "has_suspicious_keywords": self._has_suspicious_keywords(url),
-                "domain_age_days": 0,  # Would need WHOIS lookup
-                "special_char_count": sum(1 for c in url if not c.isalnum() and c not in '.-_~:/?#[]@!$&\'()*+,;='),
-                "tld": extracted.suffix,
-                "domain": extracted.domain,
-                "subdomain": extracted.subdomain
-            }
-            
-            # Convert numpy types to native Python types
-            return convert_numpy_types(features)
-            
-        except Exception as e:
-            logger.error(f"❌ Feature extraction error: {str(e)}")
-            return {"error": str(e)}
+        """Extract comprehensive features from URL (memoized; do not mutate the result)"""
+        return _extract_url_features_cached(url)
     
     def _predict_url_safety(self, url: str, features: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Make ML-based prediction on URL safety"""
@@ -268,12 +455,14 @@ class QRURLSafetyService:
             return None
             
         try:
-            # Prepare features for model
+            # Prepare features for model (1 x n sparse row)
             feature_vector = self._prepare_feature_vector(url, features)
+            if feature_vector is None:
+                return None
             
-            # Make prediction
-            prediction_proba = self.model.predict_proba([feature_vector])[0]
-            prediction = self.model.predict([feature_vector])[0]
+            # Make prediction; predict() is just the argmax of predict_proba, so run the model once
+            prediction_proba = self.model.predict_proba(feature_vector)[0]
+            prediction = self.model.classes_[prediction_proba.argmax()]
             
             # Get class labels
             classes = self.label_encoder.classes_
@@ -287,58 +476,121 @@ class QRURLSafetyService:
                 "model_version": "2.0.0"
             }
             
-            # Convert numpy types to native Python types
-            return convert_numpy_types(result)
+            # Converted to native types along with the rest of the analysis
+            return result
             
         except Exception as e:
             logger.error(f"❌ ML prediction error: {str(e)}")
             return None
     
-    async def _virustotal_analysis(self, url: str) -> Optional[Dict[str, Any]]:
-        """Analyze URL using VirusTotal API"""
+    async def _virustotal_analysis(self, url: str, http_session: Optional[aiohttp.ClientSession] = None) -> Optional[Dict[str, Any]]:
+        """Analyze URL using VirusTotal API
+        
+        Verdicts are cached per URL for _VT_CACHE_TTL seconds and concurrent
+        lookups of one URL share a single round of VT requests, which keeps
+        repeated scans inside the VT quota.
+        """
         if not self.virustotal_api_key:
             return None
-            
+        
+        key = hashlib.sha256(url.encode()).hexdigest()
+        task = self._vt_cache.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._virustotal_lookup(url, http_session))
+            self._vt_cache[key] = task
+            task.add_done_callback(lambda done, key=key: self._expire_vt_result(key, done))
+        
+        return await asyncio.shield(task)
+    
+    def _expire_vt_result(self, key: str, task: asyncio.Task):
+        """Drop failed lookups now and successful ones after _VT_CACHE_TTL"""
+        if task.cancelled() or task.exception() is not None or task.result() is None:
+            self._vt_cache.pop(key, None)
+        else:
+            task.get_loop().call_later(_VT_CACHE_TTL, self._vt_cache.pop, key, None)
+    
+    async def _virustotal_lookup(self, url: str, http_session: Optional[aiohttp.ClientSession] = None) -> Optional[Dict[str, Any]]:
+        """Run one VirusTotal submission and poll (see _virustotal_analysis)
+        
+        Uses the app-wide session when given; outside the app (scripts, tests)
+        a throwaway session is opened for this one lookup.
+        """
+        if http_session is None:
+            async with aiohttp.ClientSession() as session:
+                return await self._virustotal_lookup(url, session)
+        
+        session = http_session
         try:
             # Encode URL for VirusTotal API
             url_id = base64.urlsafe_b64encode(url.encode()).decode().strip("=")
             
-            headers = {
-                "x-apikey": self.virustotal_api_key
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                # Submit URL for analysis
-                submit_url = "https://www.virustotal.com/api/v3/urls"
-                async with session.post(submit_url, headers=headers, data={"url": url}) as response:
-                    if response.status == 200:
-                        submit_data = await response.json()
-                        analysis_id = submit_data.get("data", {}).get("id")
-                        
-                        # Wait a bit for analysis
-                        await asyncio.sleep(2)
-                        
-                        # Get analysis results
-                        result_url = f"https://www.virustotal.com/api/v3/analyses/{analysis_id}"
-                        async with session.get(result_url, headers=headers) as result_response:
-                            if result_response.status == 200:
-                                result_data = await result_response.json()
-                                stats = result_data.get("data", {}).get("attributes", {}).get("stats", {})
-                                
-                                return {
-                                    "malicious": stats.get("malicious", 0),
-                                    "suspicious": stats.get("suspicious", 0),
-                                    "harmless": stats.get("harmless", 0),
-                                    "undetected": stats.get("undetected", 0),
-                                    "total_scans": sum(stats.values()) if stats else 0,
-                                    "analysis_date": datetime.now().isoformat()
-                                }
-            
+            # Submit URL for analysis
+            submit_url = "https://www.virustotal.com/api/v3/urls"
+            submit_data = await self._vt_request(session, "POST", submit_url, max_wait=_VT_MAX_TOKEN_WAIT, data={"url": url})
+            if submit_data is None:
+                return None
+            analysis_id = submit_data.get("data", {}).get("id")
+            
+            # Poll for the results with growing waits; VT often finishes well under a second.
+            # Polls only use quota that is already available, and stop once it runs out
+            result_url = f"https://www.virustotal.com/api/v3/analyses/{analysis_id}"
+            attributes = {}
+            for delay in _VT_POLL_DELAYS:
+                await asyncio.sleep(delay)
+                result_data = await self._vt_request(session, "GET", result_url, max_wait=0.0)
+                if result_data is None:
+                    break
+                attributes = result_data.get("data", {}).get("attributes", {})
+                if attributes.get("status") == "completed":
+                    break
+            
+            if attributes:
+                stats = attributes.get("stats", {})
+                return {
+                    "malicious": stats.get("malicious", 0),
+                    "suspicious": stats.get("suspicious", 0),
+                    "harmless": stats.get("harmless", 0),
+                    "undetected": stats.get("undetected", 0),
+                    "total_scans": sum(stats.values()) if stats else 0,
+                    "analysis_date": datetime.now().isoformat()
+                }
+        
         except Exception as e:
             logger.error(f"❌ VirusTotal analysis error: {str(e)}")
         
         return None
     
+    async def _vt_request(self, session: aiohttp.ClientSession, method: str, url: str,
+                          max_wait: float = 0.0, **kwargs) -> Optional[Dict[str, Any]]:
+        """Rate-limited VirusTotal API call; retries 429s with backoff, None on failure
+        
+        Gives up (None) rather than wait more than max_wait seconds for quota.
+        """
+        headers = {
+            "x-apikey": self.virustotal_api_key
+        }
+        for attempt in range(_VT_MAX_RETRIES):
+            if not await _vt_limiter.acquire(max_wait):
+                logger.info(f"VirusTotal quota exhausted, skipping {method} {url}")
+                return None
+            async with session.request(method, url, headers=headers, timeout=_VT_TIMEOUT, **kwargs) as response:
+                if response.status == 200:
+                    return await response.json()
+                if response.status != 429:
+                    logger.warning(f"VirusTotal {method} {url} returned {response.status}")
+                    return None
+                retry_after = response.headers.get("Retry-After", "")
+            
+            # Over quota: wait as long as VT asks, or back off exponentially (within max_wait)
+            delay = int(retry_after) if retry_after.isdigit() else 2 ** attempt
+            if delay > max_wait:
+                logger.info(f"VirusTotal rate limited, skipping {method} {url}")
+                return None
+            await asyncio.sleep(delay)
+        
+        logger.warning(f"VirusTotal {method} {url} still rate limited after {_VT_MAX_RETRIES} attempts")
+        return None
+    
     def _calculate_risk_score(self, ml_prediction: Optional[Dict], vt_analysis: Optional[Dict], features: Dict) -> int:
         """Calculate overall risk score from multiple sources"""
         base_score = 30  # Base medium risk
@@ -408,19 +660,21 @@ class QRURLSafetyService:
                 "Be cautious with personal information"
             ]
     
-    def _prepare_feature_vector(self, url: str, features: Dict) -> List:
-        """Prepare feature vector for ML model"""
+    def _prepare_feature_vector(self, url: str, features: Dict) -> Optional[Any]:
+        """Prepare the feature row for the ML model as a 1 x n CSR matrix"""
         # This would depend on how your model was trained
         # Adjust based on your actual model requirements
         if not self.vectorizer:
-            return []
+            return None
         
         try:
-            # Text features
-            text_features = self.vectorizer.transform([url]).toarray()[0]
+            from scipy.sparse import csr_matrix, hstack  # Only needed when a model is loaded
+            
+            # Text features (kept sparse; the TF-IDF vocabulary can be thousands wide)
+            text_features = self.vectorizer.transform([url])
             
             # Numerical features
-            numerical_features = [
+            numerical_features = [[
                 features.get("url_length", 0),
                 features.get("domain_length", 0),
                 features.get("path_length", 0),
@@ -430,31 +684,17 @@ class QRURLSafetyService:
                 int(features.get("is_https", False)),
                 int(features.get("has_suspicious_keywords", False)),
                 features.get("special_char_count", 0)
-            ]
+            ]]
             
-            return np.concatenate([text_features, numerical_features]).tolist()
+            # float32 end to end: the forest casts its input to float32, so this skips a copy
+            return hstack(
+                [text_features, csr_matrix(numerical_features, dtype=np.float32)],
+                format='csr', dtype=np.float32
+            )
             
         except Exception as e:
             logger.error(f"❌ Feature vector preparation error: {str(e)}")
-            return []
-    
-    def _is_ip_address(self, netloc: str) -> bool:
-        """Check if netloc is an IP address"""
-        try:
-            parts = netloc.split(':')[0].split('.')
-            return len(parts) == 4 and all(part.isdigit() and 0 <= int(part) <= 255 for part in parts)
-        except:
-            return False
-    
-    def _has_suspicious_keywords(self, url: str) -> bool:
-        """Check for suspicious keywords in URL"""
-        suspicious_keywords = [
-            'secure', 'account', 'update', 'verify', 'login', 'signin',
-            'banking', 'paypal', 'amazon', 'microsoft', 'google',
-            'free', 'win', 'prize', 'urgent', 'suspend', 'limited'
-        ]
-        url_lower = url.lower()
-        return any(keyword in url_lower for keyword in suspicious_keywords)
+            return None
     
     def get_service_status(self) -> Dict[str, Any]:
         """Get current service status"""
@@ -478,6 +718,3 @@ class QRURLSafetyService:
 
 # Global service instance
 qr_service = QRURLSafetyService()
-
-# Import fix for missing io
-import io
\ No newline at end of file
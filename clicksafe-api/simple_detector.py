@@ -106,6 +106,9 @@ SUSPICIOUS_URL_PATTERNS = [
     r'account.*suspended', r'security.*alert'
 ]
 
+# Compiled once at import; kept separate so each match can be reported
+_SUSPICIOUS_URL_RES = [(pattern, re.compile(pattern, re.IGNORECASE)) for pattern in SUSPICIOUS_URL_PATTERNS]
+
 # Legitimate domains (whitelist)
 LEGITIMATE_DOMAINS = [
     'google.com', 'youtube.com', 'facebook.com', 'amazon.com', 'microsoft.com',
@@ -113,6 +116,48 @@ LEGITIMATE_DOMAINS = [
     'stackoverflow.com', 'wikipedia.org', 'reddit.com', 'netflix.com'
 ]
 
+# Message pattern groups; each group is compiled into one alternation, since
+# only whether any pattern in the group matches is scored
+URGENCY_PATTERNS = [
+    r'urgent', r'immediate', r'expires?', r'deadline', r'act now',
+    r'limited time', r'hurry', r'don\'t wait', r'time sensitive',
+    r'expires today', r'expires soon', r'final notice', r'last chance'
+]
+
+FINANCIAL_PATTERNS = [
+    r'\$\d+', r'money', r'payment', r'credit', r'bank', r'account',
+    r'refund', r'billing', r'invoice', r'transaction', r'transfer',
+    r'wire', r'deposit', r'withdraw', r'balance', r'overdraft'
+]
+
+EMOTIONAL_PATTERNS = [
+    r'congratulations', r'winner', r'selected', r'lucky', r'special offer',
+    r'exclusive', r'free', r'gift', r'prize', r'reward', r'bonus'
+]
+
+AUTHORITY_PATTERNS = [
+    r'government', r'irs', r'fbi', r'police', r'court', r'legal',
+    r'tax', r'customs', r'immigration', r'homeland security'
+]
+
+TECH_PATTERNS = [
+    r'computer', r'virus', r'malware', r'infected', r'security',
+    r'tech support', r'microsoft', r'windows', r'antivirus'
+]
+
+REQUEST_PATTERNS = [r'click here', r'verify', r'confirm', r'update', r'login']
+
+def _compile_group(patterns: List[str]) -> re.Pattern:
+    """Compile a pattern group into a single alternation"""
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
+
+_URGENCY_RE = _compile_group(URGENCY_PATTERNS)
+_FINANCIAL_RE = _compile_group(FINANCIAL_PATTERNS)
+_EMOTIONAL_RE = _compile_group(EMOTIONAL_PATTERNS)
+_AUTHORITY_RE = _compile_group(AUTHORITY_PATTERNS)
+_TECH_RE = _compile_group(TECH_PATTERNS)
+_REQUEST_RE = _compile_group(REQUEST_PATTERNS)
+
 def detect_language(text: str) -> str:
     """Simple language detection based on character patterns"""
     # Count different script characters
@@ -159,8 +204,8 @@ def analyze_url(url: str) -> Dict:
         risk_score = 0
         
         # Check for suspicious patterns
-        for pattern in SUSPICIOUS_URL_PATTERNS:
-            if re.search(pattern, url, re.IGNORECASE):
+        for pattern, pattern_re in _SUSPICIOUS_URL_RES:
+            if pattern_re.search(url):
                 suspicious_reasons.append(f'Matches suspicious pattern: {pattern}')
                 risk_score += 20
         
@@ -216,69 +261,34 @@ def analyze_message(text: str) -> Dict:
     suspicious_patterns = []
     
     # Enhanced urgency indicators
-    urgency_patterns = [
-        r'urgent', r'immediate', r'expires?', r'deadline', r'act now',
-        r'limited time', r'hurry', r'don\'t wait', r'time sensitive',
-        r'expires today', r'expires soon', r'final notice', r'last chance'
-    ]
-    for pattern in urgency_patterns:
-        if re.search(pattern, text_lower):
-            suspicious_patterns.append('Urgency indicators')
-            risk_score += 15
-            break
+    if _URGENCY_RE.search(text_lower):
+        suspicious_patterns.append('Urgency indicators')
+        risk_score += 15
     
     # Enhanced financial indicators
-    financial_patterns = [
-        r'\$\d+', r'money', r'payment', r'credit', r'bank', r'account',
-        r'refund', r'billing', r'invoice', r'transaction', r'transfer',
-        r'wire', r'deposit', r'withdraw', r'balance', r'overdraft'
-    ]
-    for pattern in financial_patterns:
-        if re.search(pattern, text_lower):
-            suspicious_patterns.append('Financial content')
-            risk_score += 12
-            break
+    if _FINANCIAL_RE.search(text_lower):
+        suspicious_patterns.append('Financial content')
+        risk_score += 12
     
     # Emotional manipulation patterns
-    emotional_patterns = [
-        r'congratulations', r'winner', r'selected', r'lucky', r'special offer',
-        r'exclusive', r'free', r'gift', r'prize', r'reward', r'bonus'
-    ]
-    for pattern in emotional_patterns:
-        if re.search(pattern, text_lower):
-            suspicious_patterns.append('Emotional manipulation')
-            risk_score += 10
-            break
+    if _EMOTIONAL_RE.search(text_lower):
+        suspicious_patterns.append('Emotional manipulation')
+        risk_score += 10
     
     # Authority impersonation patterns
-    authority_patterns = [
-        r'government', r'irs', r'fbi', r'police', r'court', r'legal',
-        r'tax', r'customs', r'immigration', r'homeland security'
-    ]
-    for pattern in authority_patterns:
-        if re.search(pattern, text_lower):
-            suspicious_patterns.append('Authority impersonation')
-            risk_score += 20
-            break
+    if _AUTHORITY_RE.search(text_lower):
+        suspicious_patterns.append('Authority impersonation')
+        risk_score += 20
     
     # Tech support scam patterns
-    tech_patterns = [
-        r'computer', r'virus', r'malware', r'infected', r'security',
-        r'tech support', r'microsoft', r'windows', r'antivirus'
-    ]
-    for pattern in tech_patterns:
-        if re.search(pattern, text_lower):
-            suspicious_patterns.append('Tech support scam indicators')
-            risk_score += 15
-            break
+    if _TECH_RE.search(text_lower):
+        suspicious_patterns.append('Tech support scam indicators')
+        risk_score += 15
     
     # Check for suspicious requests
-    request_patterns = [r'click here', r'verify', r'confirm', r'update', r'login']
-    for pattern in request_patterns:
-        if re.search(pattern, text_lower):
-            suspicious_patterns.append('Suspicious requests')
-            risk_score += 18
-            break
+    if _REQUEST_RE.search(text_lower):
+        suspicious_patterns.append('Suspicious requests')
+        risk_score += 18
     
     # Cap risk score at 95
     risk_score = min(risk_score, 95)
@@ -349,4 +359,9 @@ def simple_predict(text: str) -> Dict:
             'suspicious_terms': message_analysis['found_keywords'][:5],  # Limit to 5
             'explanation': explanation,
             'is_safe': classification == 'safe'
-        }
\ No newline at end of file
+        }
+
+
+def simple_predict_batch(texts: List[str]) -> List[Dict]:
+    """Run simple_predict over a batch of texts, preserving order"""
+    return [simple_predict(text) for text in texts]
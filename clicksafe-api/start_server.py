@@ -1,14 +1,25 @@
 """
 Startup script to run the ClickSafe backend server
 """
+import os
 import uvicorn
-from main import app
+
+from init_db import DB_INITIALIZED_ENV, init_database
 
 if __name__ == "__main__":
+    # Schema and admin user are set up once here, not in every worker
+    init_database()
+    os.environ[DB_INITIALIZED_ENV] = "1"
+    
     uvicorn.run(
-        app, 
+        "main:app", 
         host="0.0.0.0", 
         port=8000, 
         reload=False,
+        # One by default: SQLite serializes writes, and caches, queues and the
+        # VirusTotal quota are per process
+        workers=int(os.getenv("WORKERS", 1)),
+        loop="auto",
+        http="auto",
         access_log=True
     )
\ No newline at end of file
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Unit Tests for the QR CERT report queue
+Tests that a full delivery queue is reported to clients as 503
+"""
+import unittest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+from unittest.mock import patch, Mock, AsyncMock
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import qr_routes
+from database import get_db
+from qr_cert_service import QRCERTService
+
+QUEUE_FULL_RESULT = {
+    'success': False,
+    'error': 'CERT report queue is full, please retry later',
+    'queue_full': True,
+    'report_id': 'QR-20260101000000-0001',
+    'email_sent': False,
+    'submitted_at': '2026-01-01T00:00:00'
+}
+
+class TestQRCERTServiceQueue(unittest.IsolatedAsyncioTestCase):
+    """Test QRCERTService.submit_qr_cert_report against a bounded queue"""
+    
+    async def test_submit_queues_report(self):
+        service = QRCERTService()
+        
+        with patch.object(service, "start"):
+            result = await service.submit_qr_cert_report({'url': 'https://evil.example', 'risk_score': 90})
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(service._queue.qsize(), 1)
+        report, attempts = service._queue.get_nowait()
+        self.assertEqual(report['report_id'], result['report_id'])
+        self.assertEqual(attempts, 0)
+    
+    async def test_submit_rejects_when_queue_full(self):
+        service = QRCERTService()
+        service._queue = asyncio.Queue(maxsize=1)
+        service._queue.put_nowait(({}, 0))
+        
+        with patch.object(service, "start"):
+            result = await service.submit_qr_cert_report({'url': 'https://evil.example', 'risk_score': 90})
+        
+        self.assertFalse(result['success'])
+        self.assertTrue(result['queue_full'])
+        self.assertFalse(result['email_sent'])
+        self.assertEqual(service._queue.qsize(), 1)
+
+class TestQRCERTRoutesQueueFull(unittest.TestCase):
+    """Test that both CERT endpoints answer 503 when the queue is full"""
+    
+    def setUp(self):
+        app = FastAPI()
+        app.include_router(qr_routes.qr_router)
+        app.dependency_overrides[get_db] = lambda: Mock()
+        app.dependency_overrides[qr_routes.get_current_user] = lambda: Mock(
+            email="reporter@example.com", full_name="Reporter", username="reporter"
+        )
+        self.client = TestClient(app)
+        
+        patcher = patch.object(
+            qr_routes.qr_cert_service, "submit_qr_cert_report",
+            AsyncMock(return_value=dict(QUEUE_FULL_RESULT))
+        )
+        self.submit = patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_cert_report_queue_full_is_503(self):
+        response = self.client.post(
+            "/api/qr/report/cert", json={"url": "https://evil.example", "risk_score": 90}
+        )
+        
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["detail"], QUEUE_FULL_RESULT['error'])
+        self.submit.assert_awaited_once()
+    
+    def test_cert_v2_report_queue_full_is_503(self):
+        response = self.client.post(
+            "/api/qr/report/cert-v2", json={"url": "https://evil.example", "risk_score": 90}
+        )
+        
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["detail"], QUEUE_FULL_RESULT['error'])
+        self.submit.assert_awaited_once()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Unit Tests for QR Scan History
+Tests the buffered and streamed paths of GET /api/qr/scan/history
+"""
+import unittest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import json
+from datetime import datetime, timedelta
+from unittest.mock import patch, Mock
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import qr_routes
+from database import Base, get_db
+from models import User, UserScan
+
+class TestScanHistory(unittest.TestCase):
+    """Test scan history pagination over an in-memory database"""
+    
+    def setUp(self):
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        Base.metadata.create_all(bind=engine)
+        self.TestSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        
+        db = self.TestSession()
+        user = User(email="history@example.com", username="history", full_name="History User")
+        db.add(user)
+        db.commit()
+        self.user = Mock(id=user.id, email=user.email)
+        
+        start = datetime(2026, 1, 1)
+        db.add_all([
+            UserScan(
+                user_id=user.id, scan_type="url", content=f"https://example.com/{i}",
+                classification="low", risk_score=10.0, language="url",
+                explanation='["ok"]', created_at=start + timedelta(minutes=i)
+            )
+            for i in range(120)
+        ])
+        db.commit()
+        db.close()
+        
+        def override_get_db():
+            session = self.TestSession()
+            try:
+                yield session
+            finally:
+                session.close()
+        
+        app = FastAPI()
+        app.include_router(qr_routes.qr_router)
+        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[qr_routes.get_current_user] = lambda: self.user
+        self.client = TestClient(app)
+        
+        # The streamed path opens its own session
+        patcher = patch.object(qr_routes, "SessionLocal", self.TestSession)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_buffered_page(self):
+        response = self.client.get("/api/qr/scan/history", params={"page": 2, "page_size": 20})
+        
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["total_count"], 120)
+        self.assertEqual(len(data["scans"]), 20)
+        # Newest first: page 2 starts at the 21st newest scan
+        self.assertEqual(data["scans"][0]["content"], "https://example.com/99")
+        self.assertEqual(data["scans"][0]["recommendations"], ["ok"])
+    
+    def test_streamed_page(self):
+        page_size = qr_routes.STREAM_HISTORY_PAGE_SIZE + 50
+        response = self.client.get("/api/qr/scan/history", params={"page": 1, "page_size": page_size})
+        
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data["total_count"], 120)
+        self.assertEqual(data["page_size"], page_size)
+        self.assertEqual(len(data["scans"]), 120)
+        self.assertEqual(data["scans"][0]["content"], "https://example.com/119")
+        self.assertEqual(data["scans"][-1]["content"], "https://example.com/0")
+    
+    def test_streamed_page_past_the_end(self):
+        page_size = qr_routes.STREAM_HISTORY_PAGE_SIZE + 50
+        response = self.client.get("/api/qr/scan/history", params={"page": 3, "page_size": page_size})
+        
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data["scans"], [])
+        self.assertEqual(data["total_count"], 120)
+    
+    def test_streamed_query_error_is_a_500(self):
+        broken_session = Mock()
+        broken_session.query.side_effect = RuntimeError("database is locked")
+        
+        with patch.object(qr_routes, "SessionLocal", return_value=broken_session):
+            response = self.client.get(
+                "/api/qr/scan/history",
+                params={"page_size": qr_routes.STREAM_HISTORY_PAGE_SIZE + 1}
+            )
+        
+        self.assertEqual(response.status_code, 500)
+        broken_session.close.assert_called_once()
+    
+    def test_page_size_is_capped(self):
+        response = self.client.get(
+            "/api/qr/scan/history", params={"page_size": qr_routes.MAX_HISTORY_PAGE_SIZE + 1}
+        )
+        self.assertEqual(response.status_code, 422)
+
+if __name__ == "__main__":
+    unittest.main()
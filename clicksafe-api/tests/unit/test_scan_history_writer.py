@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Unit Tests for Background Batch Writers
+Tests collect_batch and the ScanHistoryWriter used for QR/URL scan history
+"""
+import unittest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+from unittest.mock import patch
+
+from batching import collect_batch
+import qr_routes
+from qr_routes import ScanHistoryWriter
+
+def scan_row(user_id, content="https://example.com"):
+    """Minimal UserScan values as the QR routes submit them"""
+    return {
+        "user_id": user_id,
+        "scan_type": "url",
+        "content": content,
+        "classification": "low",
+        "risk_score": 10.0
+    }
+
+class FakeAsyncSession:
+    """Stands in for AsyncSessionLocal(); rows without a user_id violate NOT NULL"""
+    
+    def __init__(self, saved, calls):
+        self.saved = saved
+        self.calls = calls
+        self.pending = []
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc):
+        return False
+    
+    async def execute(self, statement, params=None):
+        rows = params if params is not None else [statement.compile().params]
+        self.calls.append(len(rows))
+        if any(row.get("user_id") is None for row in rows):
+            raise ValueError("NOT NULL constraint failed: user_scans.user_id")
+        self.pending.extend(rows)
+    
+    async def commit(self):
+        self.saved.extend(self.pending)
+        self.pending = []
+    
+    async def rollback(self):
+        self.pending = []
+
+class TestCollectBatch(unittest.IsolatedAsyncioTestCase):
+    """Test the shared micro-batching loop"""
+    
+    async def test_stops_at_max_batch_size(self):
+        queue = asyncio.Queue()
+        for i in range(5):
+            queue.put_nowait(i)
+        
+        batch = await collect_batch(queue, max_batch_size=3, max_latency=1.0)
+        
+        self.assertEqual(batch, [0, 1, 2])
+        self.assertEqual(queue.qsize(), 2)
+    
+    async def test_returns_partial_batch_after_latency_window(self):
+        queue = asyncio.Queue()
+        queue.put_nowait("only")
+        
+        batch = await asyncio.wait_for(collect_batch(queue, max_batch_size=10, max_latency=0.01), 1.0)
+        
+        self.assertEqual(batch, ["only"])
+
+class TestScanHistoryWriter(unittest.IsolatedAsyncioTestCase):
+    """Test ScanHistoryWriter batching and failure handling"""
+    
+    def setUp(self):
+        self.saved = []
+        self.calls = []
+        patcher = patch.object(qr_routes, "AsyncSessionLocal",
+                               lambda: FakeAsyncSession(self.saved, self.calls))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    async def test_submit_without_start_is_rejected(self):
+        writer = ScanHistoryWriter()
+        self.assertFalse(writer.submit(scan_row(1)))
+    
+    async def test_submit_when_full_is_rejected(self):
+        writer = ScanHistoryWriter(max_pending=1)
+        writer.queue = asyncio.Queue(maxsize=1)  # Started, but with the flusher not draining
+        
+        self.assertTrue(writer.submit(scan_row(1)))
+        self.assertFalse(writer.submit(scan_row(2)))
+    
+    async def test_rows_are_written_in_one_batch(self):
+        writer = ScanHistoryWriter(max_latency_ms=20)
+        writer.start()
+        for user_id in range(1, 6):
+            self.assertTrue(writer.submit(scan_row(user_id)))
+        await writer.stop()
+        
+        self.assertEqual([row["user_id"] for row in self.saved], [1, 2, 3, 4, 5])
+        self.assertEqual(self.calls, [5])
+    
+    async def test_bad_row_does_not_lose_the_batch(self):
+        writer = ScanHistoryWriter(max_latency_ms=20)
+        writer.start()
+        for user_id in (1, None, 3):
+            writer.submit(scan_row(user_id))
+        await writer.stop()
+        
+        # The batch insert fails, then each row is retried on its own
+        self.assertEqual([row["user_id"] for row in self.saved], [1, 3])
+        self.assertEqual(self.calls, [3, 1, 1, 1])
+
+if __name__ == "__main__":
+    unittest.main()
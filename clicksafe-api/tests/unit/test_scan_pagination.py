@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Unit Tests for scan list pagination
+Tests keyset pagination of GET /scans/ via before_id and X-Next-Before-Id
+"""
+import unittest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import tempfile
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from dashboard_routes import scans_router, get_current_user
+from database import Base, get_async_db
+from models import User, UserScan
+
+class TestScanPagination(unittest.TestCase):
+    """Test before_id boundaries over a temporary SQLite database"""
+    
+    def setUp(self):
+        db_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(db_dir.cleanup)
+        db_path = os.path.join(db_dir.name, "scans.db")
+        
+        engine = create_engine(f"sqlite:///{db_path}", poolclass=NullPool)
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        user = User(email="pages@example.com", username="pages", full_name="Pages User")
+        db.add(user)
+        db.commit()
+        start = datetime(2026, 1, 1)
+        db.add_all([
+            UserScan(
+                user_id=user.id, scan_type="message", content=f"message {i}",
+                classification="safe", risk_score=5.0, language="en",
+                created_at=start + timedelta(minutes=i)
+            )
+            for i in range(5)
+        ])
+        db.commit()
+        self.user = Mock(id=user.id)
+        db.close()
+        
+        async_session = async_sessionmaker(
+            create_async_engine(f"sqlite+aiosqlite:///{db_path}", poolclass=NullPool),
+            expire_on_commit=False
+        )
+        
+        async def override_get_async_db():
+            async with async_session() as session:
+                yield session
+        
+        app = FastAPI()
+        app.include_router(scans_router)
+        app.dependency_overrides[get_async_db] = override_get_async_db
+        app.dependency_overrides[get_current_user] = lambda: self.user
+        self.client = TestClient(app)
+    
+    def get_page(self, **params):
+        response = self.client.get("/scans/", params=params)
+        self.assertEqual(response.status_code, 200)
+        return [scan["id"] for scan in response.json()], response.headers.get("X-Next-Before-Id")
+    
+    def test_pages_cover_every_scan_once(self):
+        self.assertEqual(self.get_page(limit=2), ([5, 4], "4"))
+        self.assertEqual(self.get_page(limit=2, before_id=4), ([3, 2], "2"))
+        self.assertEqual(self.get_page(limit=2, before_id=2), ([1], "1"))
+    
+    def test_before_id_is_exclusive(self):
+        ids, _ = self.get_page(limit=50, before_id=3)
+        self.assertEqual(ids, [2, 1])
+    
+    def test_past_the_last_page(self):
+        self.assertEqual(self.get_page(limit=2, before_id=1), ([], None))
+    
+    def test_before_id_must_be_positive(self):
+        response = self.client.get("/scans/", params={"before_id": 0})
+        self.assertEqual(response.status_code, 422)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Unit Tests for the verified token cache
+Tests cache hits and expiry in auth.verify_token_cached
+"""
+import unittest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import time
+from unittest.mock import patch
+
+import auth
+
+class TestVerifiedTokenCache(unittest.TestCase):
+    """Test auth.verify_token_cached"""
+    
+    def setUp(self):
+        auth._verified_tokens.clear()
+        self.addCleanup(auth._verified_tokens.clear)
+        self.payload = {"sub": "user@example.com", "exp": time.time() + 3600}
+    
+    def test_cache_hit(self):
+        with patch.object(auth, "verify_token", return_value=self.payload) as verify:
+            self.assertIs(auth.verify_token_cached("token"), self.payload)
+            self.assertIs(auth.verify_token_cached("token"), self.payload)
+        
+        verify.assert_called_once_with("token")
+    
+    def test_cache_expiry(self):
+        with patch.object(auth, "TOKEN_CACHE_TTL_SECONDS", -1), \
+             patch.object(auth, "verify_token", return_value=self.payload) as verify:
+            auth.verify_token_cached("token")
+            auth.verify_token_cached("token")
+        
+        self.assertEqual(verify.call_count, 2)
+    
+    def test_entry_never_outlives_token(self):
+        self.payload["exp"] = time.time() - 1
+        with patch.object(auth, "verify_token", return_value=self.payload) as verify:
+            auth.verify_token_cached("token")
+            auth.verify_token_cached("token")
+        
+        self.assertEqual(verify.call_count, 2)
+    
+    def test_invalid_tokens_are_not_cached(self):
+        with patch.object(auth, "verify_token", return_value=None) as verify:
+            self.assertIsNone(auth.verify_token_cached("bad-token"))
+            self.assertIsNone(auth.verify_token_cached("bad-token"))
+        
+        self.assertEqual(verify.call_count, 2)
+        self.assertEqual(auth._verified_tokens, {})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Unit Tests for the URL analysis cache
+Tests cache hits, shared in-flight analyses and expiry in QRURLSafetyService.analyze_url_safety
+"""
+import unittest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+from unittest.mock import patch, AsyncMock
+
+import qr_service
+from qr_service import QRURLSafetyService
+
+ANALYSIS = {"url": "https://example.com", "risk_score": 10, "recommendations": []}
+
+class TestURLAnalysisCache(unittest.IsolatedAsyncioTestCase):
+    """Test QRURLSafetyService.analyze_url_safety caching"""
+    
+    def setUp(self):
+        self.service = QRURLSafetyService()
+    
+    async def test_cache_hit(self):
+        with patch.object(self.service, "_analyze_url_uncached", AsyncMock(return_value=ANALYSIS)) as analyze:
+            first = await self.service.analyze_url_safety("https://example.com")
+            second = await self.service.analyze_url_safety("https://example.com")
+        
+        self.assertIs(first, second)
+        analyze.assert_awaited_once()
+    
+    async def test_concurrent_requests_share_one_analysis(self):
+        with patch.object(self.service, "_analyze_url_uncached", AsyncMock(return_value=ANALYSIS)) as analyze:
+            results = await asyncio.gather(
+                *(self.service.analyze_url_safety("https://example.com") for _ in range(5))
+            )
+        
+        self.assertEqual(results, [ANALYSIS] * 5)
+        analyze.assert_awaited_once()
+    
+    async def test_cache_expiry(self):
+        with patch.object(qr_service, "_URL_CACHE_TTL", -1), \
+             patch.object(self.service, "_analyze_url_uncached", AsyncMock(return_value=ANALYSIS)) as analyze:
+            await self.service.analyze_url_safety("https://example.com")
+            await self.service.analyze_url_safety("https://example.com")
+        
+        self.assertEqual(analyze.await_count, 2)
+    
+    async def test_errors_are_not_cached(self):
+        failed = {"url": "https://example.com", "error": "lookup failed"}
+        with patch.object(self.service, "_analyze_url_uncached", AsyncMock(return_value=failed)) as analyze:
+            await self.service.analyze_url_safety("https://example.com")
+            await self.service.analyze_url_safety("https://example.com")
+        
+        self.assertEqual(analyze.await_count, 2)
+        self.assertNotIn("https://example.com", self.service._url_cache)
+
+if __name__ == "__main__":
+    unittest.main()